@@ -0,0 +1,94 @@
+# coding=utf-8
+
+""" Client-side graph benchmark for the alerts of each site
+
+Measures, per site, the time to build the alerts graph (alerts image and
+vector) in Python and to serialize it, and compares it with the time to get
+the same graph from a serialized template (see geepyGLAD/templates.py).
+Needs an authenticated Earth Engine account but sends no computation.
+
+Usage:
+
+    python benchmarks/graphs.py ASSET_ID [--property NAME] [--sites N]
+        [--start YYYY-MM-DD] [--end YYYY-MM-DD] [--limit M2] [--runs N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def timeit(func, runs):
+    """ Best time (in milliseconds) of `runs` calls to `func` """
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        elapsed = (time.perf_counter() - start) * 1000.
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('asset', help='FeatureCollection of sites')
+    parser.add_argument('--property', default=None,
+                        help='property with the name of each site')
+    parser.add_argument('--sites', type=int, default=10,
+                        help='number of sites to measure')
+    parser.add_argument('--start', default='2019-01-01')
+    parser.add_argument('--end', default='2019-01-31')
+    parser.add_argument('--limit', type=float, default=1,
+                        help='minimum area (m2)')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='number of runs (the best one is reported)')
+    args = parser.parse_args()
+
+    import ee
+    ee.Initialize()
+    from geepyGLAD import alerts, utils, templates
+
+    collection = ee.FeatureCollection(args.asset)
+    features = collection.limit(args.sites).getInfo()['features']
+
+    row = '{:<30} {:>10} {:>10} {:>10} {:>10}'
+    print(row.format('site', 'build', 'serialize', 'template', 'speedup'))
+    for i, feat in enumerate(features):
+        name = feat['properties'].get(args.property, i) \
+            if args.property else i
+        geometry = ee.Geometry(feat['geometry'])
+
+        def build(start, end):
+            alert = alerts.period(start, end, geometry, args.limit)
+            return dict(alert=alert,
+                        vector=utils.make_alerts_vector(alert, geometry))
+
+        def serialize():
+            for obj in build(args.start, args.end).values():
+                ee.serializer.toJSON(obj)
+
+        cache = templates.Templates()
+        key = templates.template_key('period', geometry, args.limit)
+        cache.get(key, build, start=args.start, end=args.end)
+
+        def from_template():
+            objects = cache.get(key, build, start=args.start, end=args.end)
+            for obj in objects.values():
+                ee.serializer.toJSON(obj)
+
+        t_build = timeit(lambda: build(args.start, args.end), args.runs)
+        t_serialize = timeit(serialize, args.runs) - t_build
+        t_template = timeit(from_template, args.runs)
+        print(row.format(
+            str(name)[:30], '{:.1f} ms'.format(t_build),
+            '{:.1f} ms'.format(t_serialize), '{:.1f} ms'.format(t_template),
+            '{:.1f}x'.format((t_build + t_serialize) / t_template)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# coding=utf-8
+
+""" Import-time benchmark for the `glad` command line tool
+
+Runs `python -X importtime -c "import glad"` and checks that the cumulative
+import time stays under a budget and that heavy dependencies (ee, geetools,
+requests) are not imported just to show the help or edit the config file.
+
+Usage:
+
+    python benchmarks/importtime.py [--budget MILLISECONDS] [--runs N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# milliseconds
+BUDGET = 150
+HEAVY = ['ee', 'geetools', 'requests']
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def importtime(module='glad'):
+    """ Return a dict with the cumulative import time (in microseconds) of
+    every top-level module imported when importing `module`, and the names of
+    all imported modules """
+    cmd = [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)]
+    proc = subprocess.run(cmd, cwd=ROOT, stderr=subprocess.PIPE,
+                          stdout=subprocess.DEVNULL, universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr)
+
+    times = {}
+    names = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        line = line[len('import time:'):]
+        self_us, cumulative, name = line.split('|')
+        name = name.rstrip()
+        names.append(name.strip())
+        # only top level imports (one space of indentation)
+        if name.startswith('  '):
+            continue
+        times[name.strip()] = int(cumulative)
+    return times, names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--budget', type=float, default=BUDGET,
+                        help='maximum import time in milliseconds')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='number of runs (the best one is reported)')
+    args = parser.parse_args()
+
+    best = None
+    for _ in range(args.runs):
+        times, names = importtime()
+        total = sum(times.values()) / 1000.
+        if best is None or total < best[0]:
+            best = (total, times, names)
+
+    total, times, names = best
+    heavy = [name for name in names if name in HEAVY]
+
+    print('import glad: {:.1f} ms (budget {:.1f} ms)'.format(
+        total, args.budget))
+    for name, t in sorted(times.items(), key=lambda i: -i[1])[:10]:
+        print('  {:>8.1f} ms  {}'.format(t / 1000., name))
+
+    failed = False
+    if heavy:
+        print('heavy modules imported: {}'.format(', '.join(heavy)))
+        failed = True
+    if total > args.budget:
+        print('import time over budget')
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# coding=utf-8
+
+""" Asynchronous evaluation of Earth Engine objects """
+
+import asyncio
+import functools
+import ee
+from . import governor
+
+# default number of requests in flight at the same time
+CONCURRENCY = 8
+
+
+async def run(func, *args, **kwargs):
+    """ Run a blocking function in the default executor without blocking the
+    event loop """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(func, *args, **kwargs))
+
+
+async def getInfo(obj, semaphore=None):
+    """ Evaluate an ee.ComputedObject (or any object with a `getInfo`
+    method) asynchronously
+
+    :param obj: the object to evaluate
+    :param semaphore: if given, the evaluation waits for it before sending
+        the request
+    :type semaphore: asyncio.Semaphore
+    """
+    if semaphore is None:
+        return await run(governor.getInfo, obj)
+    async with semaphore:
+        return await run(governor.getInfo, obj)
+
+
+async def gather(objects, concurrency=CONCURRENCY):
+    """ Evaluate many objects concurrently, with at most `concurrency`
+    requests in flight. Results are returned in the same order """
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(
+        *[getInfo(obj, semaphore) for obj in objects])
+
+
+def combine(objects):
+    """ Evaluate many objects in a single request. If `objects` is a dict the
+    result is a dict with the same keys, otherwise a list in the same order
+    """
+    if isinstance(objects, dict):
+        return governor.getInfo(ee.Dictionary(objects))
+    return governor.getInfo(ee.List(list(objects)))
+
+
+def evaluate(objects, concurrency=CONCURRENCY, combined=False):
+    """ Blocking helper to evaluate many objects at once. It must not be
+    called from a running event loop (use `gather` there)
+
+    :param objects: a list of objects to evaluate, or a dict when `combined`
+        is True
+    :param combined: if True, evaluate all objects in one request (see
+        `combine`). Else, evaluate them concurrently (see `gather`)
+    """
+    if combined:
+        return combine(objects)
+    return asyncio.run(gather(objects, concurrency))
@@ -4,11 +4,92 @@
 
 import ee
 import datetime
-from . import utils
+from . import utils, cache
 from geetools import tools
 
-ALERTS = utils.cleanup_sa19(ee.ImageCollection('projects/glad/alert/UpdResult'))
-TODAY = datetime.date.today()
+_ALERTS = None
+_DATE_INDEX = None
+
+
+def get_alerts():
+    """ The GLAD alerts collection. It is built on first use, so importing
+    this module does not create any server-side object """
+    global _ALERTS
+    if _ALERTS is None:
+        _ALERTS = utils.cleanup_sa19(ee.ImageCollection(utils.ASSET_ID))
+    return _ALERTS
+
+
+def __getattr__(name):
+    """ Deferred module attributes ALERTS and TODAY """
+    if name == 'ALERTS':
+        return get_alerts()
+    if name == 'TODAY':
+        return datetime.date.today()
+    raise AttributeError(
+        "module '{}' has no attribute '{}'".format(__name__, name))
+
+
+def date_index(refresh=False):
+    """ Client side index of the GLAD images by date and region:
+    {'YYYY-MM-DD': {'REGION': [image ids]}}. It is fetched once (one request)
+    and cached """
+    global _DATE_INDEX
+    if _DATE_INDEX is None or refresh:
+        collection = ee.ImageCollection(utils.ASSET_ID)
+        pairs = collection.reduceColumns(
+            ee.Reducer.toList(2), ['system:index', 'system:time_start'])
+        pairs = cache.getInfo(pairs.get('list'))
+        index = {}
+        for imageid, millis in pairs:
+            # image that should not be there (see utils.cleanup_sa19)
+            if imageid == '01_01_SBRA':
+                continue
+            date = datetime.datetime.utcfromtimestamp(millis / 1000.)
+            region = '_'.join(imageid.split('_')[2:])
+            regions = index.setdefault(date.date().isoformat(), {})
+            regions.setdefault(region, []).append(imageid)
+        _DATE_INDEX = index
+    return _DATE_INDEX
+
+
+def dates(start=None, end=None):
+    """ Sorted list of dates (YYYY-MM-DD) with GLAD images from start to end
+    (inclusive) """
+    result = sorted(date_index())
+    if start:
+        result = [d for d in result if d >= start]
+    if end:
+        result = [d for d in result if d <= end]
+    return result
+
+
+def region_dates(region, date=None):
+    """ Sorted list of dates (YYYY-MM-DD) with images of the given region, up
+    to the given date (inclusive) """
+    index = date_index()
+    dates = sorted(d for d, regions in index.items() if region in regions)
+    if date:
+        dates = [d for d in dates if d <= date]
+    return dates
+
+
+def mosaic(date, region=None):
+    """ Mosaic of the GLAD images of the given date (YYYY-MM-DD) and region
+    (all regions if None) """
+    regions = date_index().get(date, {})
+    if region:
+        ids = regions.get(region, [])
+    else:
+        ids = [i for r in regions.values() for i in r]
+    images = [ee.Image('{}/{}'.format(utils.ASSET_ID, i)) for i in ids]
+    first = images[0]
+    # a mosaic has the default projection (1 degree), keep the GLAD one so
+    # the scale of the vectors and areas is the one of the alerts
+    result = ee.ImageCollection(images).mosaic() \
+               .setDefaultProjection(first.select(0).projection()) \
+               .copyProperties(first, ['system:time_start'])
+    return ee.Image(result).set('region', region or 'all')
 
 
 def proxy(image):
@@ -84,7 +165,7 @@ def get_probable_OLD(site, date, limit=1, smooth='max'):
 
     # filter collection up to selected date
     start = ee.Date.fromYMD(year, 1, 1)
-    col = ALERTS.filterDate(ee.Date(start), date.advance(1, 'day'))
+    col = get_alerts().filterDate(ee.Date(start), date.advance(1, 'day'))
 
     # filter bounds
     col = col.filterBounds(site)
@@ -131,7 +212,7 @@ def get_confirmed_OLD(site, date, limit=1, smooth='max'):
 
     # filter collection up to selected date
     start = ee.Date.fromYMD(year, 1, 1)
-    col = ALERTS.filterDate(ee.Date(start), date.advance(1, 'day'))
+    col = get_alerts().filterDate(ee.Date(start), date.advance(1, 'day'))
 
     col = col.filterBounds(site)
 
@@ -165,7 +246,8 @@ def get_confirmed_OLD(site, date, limit=1, smooth='max'):
 
 
 def period(start, end, site, limit, year=None, eightConnected=False,
-           useProxy=False, mask=None):
+           useProxy=False, mask=None, bounds=None, deferMask=False,
+           collection=None, exactArea=False):
     """ Compute probable and confirmed alerts over a period
 
     :param start: the start date of the period
@@ -183,6 +265,19 @@ def period(start, end, site, limit, year=None, eightConnected=False,
     :param mask: a mask to apply to results. Typically a forest mask. If a
         string is passed, it will try to load it as an Image asset
     :type mask: ee.Image or str
+    :param bounds: a cheap geometry (bounding box or simplified geometry)
+        used only to filter the collection. If None, uses the site
+    :type bounds: ee.Geometry
+    :param deferMask: if True, the mask is applied once to the difference
+        between the first and last images (before removing islands) instead
+        of to every image of the collection. The result is the same, but it
+        is much cheaper
+    :param collection: the GLAD collection to use. If None, uses the whole
+        collection filtered by the site (or bounds)
+    :type collection: ee.ImageCollection
+    :param exactArea: if True, the `area` band holds the exact area of each
+        cluster of alerts (see utils.exact_area). Otherwise clusters bigger
+        than 512 pixels get the area of 512 pixels
     """
     if isinstance(site, (ee.Feature, ee.FeatureCollection)):
         region = site.geometry()
@@ -192,14 +287,19 @@ def period(start, end, site, limit, year=None, eightConnected=False,
     start = ee.Date(start)
     end = ee.Date(end).advance(1, 'day')
 
-    filtered = ALERTS.filterBounds(region)
+    if collection is None:
+        filtered = get_alerts().filterBounds(bounds or region)
+    else:
+        filtered = collection
 
+    maski = None
     if mask:
         if isinstance(mask, (ee.Image,)):
             maski = mask
         else:
             maski = ee.Image(mask)
-        filtered = filtered.map(lambda img: img.updateMask(maski))
+        if not deferMask:
+            filtered = filtered.map(lambda img: img.updateMask(maski))
 
     sort = filtered.sort('system:time_start', True) # sort ascending
     filteredDate = sort.filterDate(start, end)
@@ -233,23 +333,27 @@ def period(start, end, site, limit, year=None, eightConnected=False,
 
     diff = lastconf.subtract(firstconf)
 
+    # deferred mask: before the islands so clusters stay inside the mask
+    if maski is not None and deferMask:
+        diff = diff.updateMask(maski)
+
     probname = ee.String('probable').cat(yearStr)
     confname = ee.String('confirmed').cat(yearStr)
 
     probable = diff.eq(2).rename(probname)
     confirmed = diff.eq(1).Or(diff.eq(3)).rename(confname)
 
-    probable = utils.get_rid_islands(probable, limit, eightConnected)
-    confirmed = utils.get_rid_islands(confirmed, limit, eightConnected)
-
-    area_probable = probable.select('area')
-    area_confirmed = confirmed.select('area')
+    cleaned = utils.get_rid_islands_both(probable, confirmed, limit,
+                                         eightConnected)
 
-    probable = probable.select(probname).selfMask()
-    confirmed = confirmed.select(confname).selfMask()
+    probable = cleaned.select(probname).selfMask()
+    confirmed = cleaned.select(confname).selfMask()
 
-    area = area_probable.add(area_confirmed)
+    area = cleaned.select('area')
     mask = area.gt(0)
+    if exactArea:
+        classes = probable.unmask().add(confirmed.unmask().multiply(2))
+        area = utils.exact_area(classes.selfMask(), region, eightConnected)
     area = area.updateMask(mask)
 
     date = tools.image.doyToDate(
@@ -276,9 +380,51 @@ def period(start, end, site, limit, year=None, eightConnected=False,
         .set('year', yearInt)
 
 
-def oneday(site, date, limit=500, year=None, eightConnected=False, mask=None):
+def oneday_region(site, date, region, limit=500, year=None,
+                  eightConnected=False, mask=None, deferMask=False,
+                  exactArea=False):
+    """ Compute alerts for one day in one GLAD region. Compares the mosaics
+    of the last two dates of the region (up to the given date). Returns None
+    if the region has less than two dates """
+    if not isinstance(date, str):
+        date = date.isoformat()
+    dates = region_dates(region, date)
+    if len(dates) < 2:
+        return None
+    last, before = dates[-1], dates[-2]
+    collection = ee.ImageCollection([mosaic(before, region),
+                                     mosaic(last, region)])
+    return period(before, last, site, limit, year,
+                  eightConnected=eightConnected, mask=mask,
+                  deferMask=deferMask, collection=collection,
+                  exactArea=exactArea)
+
+
+def oneday(site, date, limit=500, year=None, eightConnected=False, mask=None,
+           bounds=None, deferMask=False, regions=None, exactArea=False):
     """ Compute alerts for one day. Takes the last available alerts and the
-    alerts 1 step before """
+    alerts 1 step before
+
+    :param regions: list of GLAD regions of the site. If given, the last two
+        dates of each region are compared (see oneday_region) and the results
+        are mosaicked, instead of the last two images of the whole collection.
+        Regions with less than two dates are skipped. If no region has two
+        dates, the last two images of the whole collection are compared
+    """
+    results = [oneday_region(site, date, region, limit, year,
+                             eightConnected, mask, deferMask, exactArea)
+               for region in regions or []]
+    results = [result for result in results if result is not None]
+    if results:
+        if len(results) == 1:
+            return results[0]
+        # keep the GLAD projection (see mosaic)
+        result = ee.ImageCollection(results).mosaic() \
+                   .setDefaultProjection(results[0].select(0).projection()) \
+                   .copyProperties(results[0],
+                                   ['start_period', 'end_period', 'year'])
+        return ee.Image(result)
+
     date = ee.Date(date)
 
     if isinstance(site, (ee.Feature, ee.FeatureCollection)):
@@ -286,25 +432,32 @@ def oneday(site, date, limit=500, year=None, eightConnected=False, mask=None):
     else:
         region = site
 
-    col = ALERTS.filterBounds(region)
+    col = get_alerts().filterBounds(bounds or region)
     col = col.filterDate(ee.Date('1970-01-01'), date.advance(1, 'day'))
 
     last = tools.imagecollection.getImage(col, -1)
     before = tools.imagecollection.getImage(col, -2)
 
     return period(before.date(), last.date().advance(1,'day'), site, limit,
-                  year, eightConnected=eightConnected, mask=mask)
+                  year, eightConnected=eightConnected, mask=mask,
+                  bounds=bounds, deferMask=deferMask, exactArea=exactArea)
 
 
-def get_probable(site, date, limit=500, eightConnected=False, mask=None):
+def get_probable(site, date, limit=500, eightConnected=False, mask=None,
+            bounds=None, deferMask=False, regions=None, exactArea=False):
     """ Get only probable alerts """
-    alerts = oneday(site, date, limit, eightConnected, mask)
+    alerts = oneday(site, date, limit, eightConnected=eightConnected,
+                    mask=mask, bounds=bounds, deferMask=deferMask,
+                    regions=regions, exactArea=exactArea)
     probable_mask = alerts.select('probable')
     return alerts.updateMask(probable_mask)
 
 
-def get_confirmed(site, date, limit=500, eightConnected=False, mask=None):
+def get_confirmed(site, date, limit=500, eightConnected=False, mask=None,
+            bounds=None, deferMask=False, regions=None, exactArea=False):
     """ Get only confirmed alerts """
-    alerts = oneday(site, date, limit, eightConnected, mask)
+    alerts = oneday(site, date, limit, eightConnected=eightConnected,
+                    mask=mask, bounds=bounds, deferMask=deferMask,
+                    regions=regions, exactArea=exactArea)
     probable_mask = alerts.select('confirmed')
     return alerts.updateMask(probable_mask)
@@ -3,12 +3,25 @@
 """ Batch module """
 
 import ee
-from . import alerts, utils
-import requests
+import json
+from . import alerts, utils, aio, cache, checkpoint, stream, governor, \
+    sites, templates
 import os
-from geetools import batch as gbatch
+import functools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 
 
+# sites with more pixels than this are likely to fail in reduceToVectors
+PLAN_MAX_PIXELS = 1e9
+
+# default number of dates processed at the same time by `backfill`
+BACKFILL_WORKERS = 4
+
+# client side alerts bigger than this (bytes of GeoJSON) are not sent in an
+# export request, the server side vector is exported instead
+INLINE_MAX_BYTES = 4 * 2**20
+
 FUNCTIONS = {
     'probable': alerts.get_probable,
     'confirmed': alerts.get_confirmed,
@@ -28,7 +41,9 @@ def mask(image, vector, raster):
 
 
 def downloadFile(url, name, ext, path=None):
-    """ Download a file from a given url
+    """ Download a file from a given url. The request goes through the
+    governor (see stream.get), and an error status raises
+    requests.HTTPError once the retries are exhausted
 
     :param url: full url
     :type url: str
@@ -39,53 +54,87 @@ def downloadFile(url, name, ext, path=None):
     :return: the created file (closed)
     :rtype: file
     """
-    response = requests.get(url, stream=True)
-    code = response.status_code
-
     if path is None:
         path = os.getcwd()
 
     path = os.path.join(path, name)
-
-    while code != 200:
-        if code == 400:
-            return None
-        response = requests.get(url, stream=True)
-        code = response.status_code
-        size = response.headers.get('content-length', 0)
-        if size: print('size:', size)
-
     filename = '{}.{}'.format(path, ext)
 
-    with open(filename, "wb") as handle:
-        for data in response.iter_content():
-            handle.write(data)
+    response = stream.get(url)
+    try:
+        with open(filename, "wb") as handle:
+            for data in response.iter_content(stream.CHUNK_SIZE):
+                handle.write(data)
+    except Exception:
+        # do not leave a partial file
+        if os.path.exists(filename):
+            os.remove(filename)
+        raise
+    finally:
+        response.close()
 
     return handle
 
 
 def _download(vector, name, extension='JSON', path=None, verbose=True,
-              logger=None):
+              logger=None, page_size=None, compression=None):
+    """ Download the vector trying several methods. Only if `page_size` is
+    given the features are fetched in pages of that size (see stream.py). If
+    `compression` is given ('gzip' or 'zstd') the file is written compressed.
+    The fallback methods parse the response while it downloads and write the
+    features one by one. Raises the error of the last method if all of them
+    fail """
+    from geetools import batch as gbatch
     if extension in ['JSON', 'json', 'geojson', 'geoJSON']:
-        try:
-            gbatch.Download.table.toGeoJSON(vector, name, path)
-        except Exception as e:
-            msg = 'Download method failed: {} \n\ntrying another method...'.format(e)
-            if verbose:
-                print(msg)
-            if logger:
-                logger.log(msg)
+        filename = os.path.join(path or os.getcwd(), '{}.geojson'.format(name))
+
+        def paginated():
+            stream.toGeoJSON(vector, filename + stream.extension(compression),
+                             page_size or stream.PAGE_SIZE,
+                             compression=compression)
+
+        def geojson():
+            governor.call(gbatch.Download.table.toGeoJSON, vector, name,
+                          path)
+            stream.compress(filename, compression)
+
+        def streamed():
+            path = filename + stream.extension(compression)
+            with stream.FeatureWriter(path, compression) as writer:
+                for feat in stream.download_features(vector):
+                    writer.write(feat)
+
+        def local():
+            governor.call(gbatch.Download.table.toLocal, vector, name,
+                          'geojson', path=path)
+            stream.compress(filename, compression)
+
+        methods = [geojson, streamed, local]
+        # streamed method first
+        if compression:
+            methods = [streamed, geojson, local]
+        # paging evaluates the vector once per page: only if asked for
+        if page_size:
+            methods.insert(0, paginated)
+
+        for i, method in enumerate(methods):
             try:
-                gbatch.Download.table.toLocal(vector, name, 'geojson',
-                                              path=path)
+                method()
             except Exception as e:
-                msg = "Download failed: {}".format(e)
+                if i < len(methods) - 1:
+                    msg = 'Download method failed: {} \n\ntrying another method...'.format(e)
+                else:
+                    msg = "Download failed: {}".format(e)
                 if verbose:
                     print(msg)
                 if logger:
                     logger.log(msg)
+                if i == len(methods) - 1:
+                    raise e
+            else:
+                break
     else:
-        print('Format {} not supported'.format(extension))
+        raise ValueError('Format {} not supported'.format(extension))
 
 
 def _toDrive(vector, filename, folder, extension, **kwargs):
@@ -96,7 +145,7 @@ def _toDrive(vector, filename, folder, extension, **kwargs):
         task = ee.batch.Export.table.toDrive(vector, filename,
                                              folder, filename,
                                              extension)
-        task.start()
+        governor.submit(task.start)
         msg = 'uploading {} to {} in GDrive'.format(filename, folder)
         if verbose:
             print(msg)
@@ -109,21 +158,26 @@ def _toDrive(vector, filename, folder, extension, **kwargs):
             print(msg)
         if logger:
             logger.log(msg)
+        return None
+    else:
+        return 'drive:{}/{}'.format(folder, filename)
 
 
 def _toAsset(vector, filename, folder, **kwargs):
     verbose = kwargs.get('verbose', False)
     logger = kwargs.get('logger', None)
 
-    user = ee.data.getAssetRoots()[0]['id']
+    user = governor.call(ee.data.getAssetRoots)[0]['id']
     path = '{}/{}'.format(user, folder)
 
     assetId = '{}/{}'.format(path, filename)
 
+    from geetools import batch as gbatch
+
     try:
         # task = ee.batch.Export.table.toAsset(vector, filename, assetId)
         # task.start()
-        gbatch.Export.table.toAsset(vector, path, filename)
+        governor.submit(gbatch.Export.table.toAsset, vector, path, filename)
         msg = 'uploading {} to {} in Assets'.format(filename, path)
         if verbose:
             print(msg)
@@ -136,14 +190,13 @@ def _toAsset(vector, filename, folder, **kwargs):
             print(msg)
         if logger:
             logger.log(msg)
+        return None
+    else:
+        return assetId
 
 
-def _toLocal(vector, filename, folder=None, extension='geojson',
-             subfolders=True, subname=None, **kwargs):
-
-    verbose = kwargs.get('verbose', True)
-    logger = kwargs.get('logger', None)
-
+def _local_path(folder=None, subfolders=True, subname=None, verbose=True):
+    """ Make (if needed) and return the local folder for the given site """
     # MANAGE ALERTS PATH
     if folder is None:
         folder = os.path.join(os.getcwd(), 'alerts')
@@ -163,31 +216,234 @@ def _toLocal(vector, filename, folder=None, extension='geojson',
     else:
         subpath = folder
 
+    return subpath
+
+
+def _toLocal(vector, filename, folder=None, extension='geojson',
+             subfolders=True, subname=None, features=None, **kwargs):
+    """ Download the vector. If the features have already been fetched
+    (`features`) they are written directly """
+    verbose = kwargs.get('verbose', True)
+    logger = kwargs.get('logger', None)
+
+    subpath = _local_path(folder, subfolders, subname, verbose)
+
     msg = '{}: Downloading "{}" to "{}"'.format(subname, filename, subpath)
     if verbose:
         print(msg)
     if logger:
         logger.log(msg)
 
+    compression = kwargs.get('compression')
+    path = os.path.join(subpath, '{}.geojson{}'.format(
+        filename, stream.extension(compression)))
     try:
-        _download(vector, filename, extension, subpath)
+        if features is not None:
+            with stream.FeatureWriter(path, compression) as writer:
+                for feat in features:
+                    writer.write(feat)
+        else:
+            _download(vector, filename, extension, subpath, verbose, logger,
+                      kwargs.get('page_size'), kwargs.get('compression'))
     except Exception as e:
-        msg = '{}: ERROR writing {}'.format(subname, filename)
+        msg = '{}: ERROR writing {} - {}'.format(subname, filename, e)
+        if verbose:
+            print(msg)
         if logger:
             logger.log(msg)
+        return None
     else:
+        if not os.path.isfile(path):
+            msg = '{}: ERROR {} was not written'.format(subname, path)
+            if verbose:
+                print(msg)
+            if logger:
+                logger.log(msg)
+            return None
         msg = '{}: "{}" downloaded to "{}"'.format(subname, filename, subpath)
         if logger:
             logger.log(msg)
+        if kwargs.get('postprocess'):
+            _postprocess(path, subname, verbose, logger,
+                         kwargs.get('exactArea', False))
+        if kwargs.get('recorder') is not None:
+            kwargs['recorder'].written(subname, os.path.getsize(path))
+        return os.path.join(subpath, filename)
+
+
+def _postprocess(path, subname, verbose=True, logger=None, exactArea=False):
+    """ Post-process a downloaded file in place and report the size
+    reduction. Errors are logged and the original file is kept """
+    from . import postprocess
+    try:
+        report = postprocess.process(path, exact_area=exactArea)
+    except Exception as e:
+        msg = '{}: ERROR post-processing {}: {}'.format(subname, path, e)
+    else:
+        msg = '{}: post-processed "{}": {} -> {} features, {} -> {} bytes' \
+              ' ({:.1f}% smaller)'.format(
+                  subname, path, report['features_in'],
+                  report['features_out'], report['bytes_in'],
+                  report['bytes_out'],
+                  100. * (1 - report['bytes_out'] /
+                          float(report['bytes_in'] or 1)))
+    if verbose:
+        print(msg)
+    if logger:
+        logger.log(msg)
+
+
+def _raster_params(image, geometry):
+    """ Parameters to export the given image in the GLAD grid as a tiled
+    GeoTIFF """
+    first = ee.ImageCollection(utils.ASSET_ID).first().select(0)
+    projection = cache.getInfo(first.projection())
+    return dict(image=image.toInt32(), region=geometry,
+                crs=projection['crs'], crsTransform=projection['transform'],
+                maxPixels=1e13)
+
+
+def _toDriveRaster(image, geometry, filename, folder, **kwargs):
+    verbose = kwargs.get('verbose', False)
+    logger = kwargs.get('logger', None)
+
+    try:
+        params = _raster_params(image, geometry)
+        task = ee.batch.Export.image.toDrive(
+            description=filename, folder=folder, fileNamePrefix=filename,
+            fileFormat='GeoTIFF', formatOptions={'cloudOptimized': True},
+            **params)
+        governor.submit(task.start)
+        msg = 'uploading raster {} to {} in GDrive'.format(filename, folder)
+        if verbose:
+            print(msg)
+        if logger:
+            logger.log(msg)
+    except Exception as e:
+        msg = 'ERROR writing raster {} - {}'.format(filename, e)
+        if verbose:
+            print(msg)
+        if logger:
+            logger.log(msg)
+        return None
+    else:
+        return 'drive:{}/{}.tif'.format(folder, filename)
+
+
+def _toAssetRaster(image, geometry, filename, folder, **kwargs):
+    verbose = kwargs.get('verbose', False)
+    logger = kwargs.get('logger', None)
+
+    user = governor.call(ee.data.getAssetRoots)[0]['id']
+    path = '{}/{}'.format(user, folder)
+    assetId = '{}/{}'.format(path, filename)
+
+    try:
+        params = _raster_params(image, geometry)
+        # class and date bands are categorical: no mean pyramids
+        task = ee.batch.Export.image.toAsset(
+            description=filename, assetId=assetId,
+            pyramidingPolicy={'.default': 'mode'}, **params)
+        governor.submit(task.start)
+        msg = 'uploading raster {} to {} in Assets'.format(filename, path)
+        if verbose:
+            print(msg)
+        if logger:
+            logger.log(msg)
+    except Exception as e:
+        msg = 'ERROR in raster {} to {} in Assets - {}'.format(
+            filename, path, e)
+        if verbose:
+            print(msg)
+        if logger:
+            logger.log(msg)
+        return None
+    else:
+        return assetId
+
+
+def _toLocalRaster(image, geometry, filename, folder=None, subfolders=True,
+                   subname=None, **kwargs):
+    verbose = kwargs.get('verbose', True)
+    logger = kwargs.get('logger', None)
+
+    subpath = _local_path(folder, subfolders, subname, verbose)
+
+    msg = '{}: Downloading raster "{}" to "{}"'.format(
+        subname, filename, subpath)
+    if verbose:
+        print(msg)
+    if logger:
+        logger.log(msg)
+
+    try:
+        params = _raster_params(image, geometry)
+        url = governor.call(params['image'].getDownloadURL, dict(
+            name=filename, region=geometry, crs=params['crs'],
+            crs_transform=params['crsTransform'], format='GEO_TIFF'))
+        downloadFile(url, filename, 'tif', subpath)
+    except Exception as e:
+        msg = '{}: ERROR writing raster {} - {}'.format(subname, filename, e)
+        if verbose:
+            print(msg)
+        if logger:
+            logger.log(msg)
+        return None
+    else:
+        msg = '{}: "{}" downloaded to "{}"'.format(subname, filename, subpath)
+        if logger:
+            logger.log(msg)
+        return os.path.join(subpath, '{}.tif'.format(filename))
+
+
+def _export_raster(image, geometry, filename, destination, folder, name,
+                   **kwargs):
+    """ Write the alerts image (see alerts.period) to the given destination
+    (or list of destinations) as a GeoTIFF. Returns a list with the written
+    outputs (None for failed writes) """
+    outputs = []
+    for dest in _destinations(destination):
+        dest_folder = _folder(folder, dest)
+        output = None
+        if dest == 'local':
+            subfolders = kwargs.get('subfolders', True)
+            output = _toLocalRaster(image, geometry, filename, dest_folder,
+                                    subfolders, name, **kwargs)
+
+        elif dest == 'drive':
+            drive_name = filename.encode().decode('ascii', errors='ignore')
+            output = _toDriveRaster(image, geometry, drive_name, dest_folder,
+                                    **kwargs)
+
+        elif dest == 'asset':
+            output = _toAssetRaster(image, geometry, filename, dest_folder,
+                                    **kwargs)
+
+        outputs.append(output)
 
+    return outputs
 
-def _are_alerts(alert, name, date, clas, region, verbose, logger):
+
+def _are_alerts(alert, name, date, clas, region, verbose=True, logger=None,
+                precheck_scale=None, **kwargs):
     try:
-        count = utils.histogram(alert, clas, region).getInfo()
+        # coarse check first, the full resolution histogram only if needed
+        if precheck_scale:
+            coarse = utils.has_alerts(alert, clas, region, precheck_scale)
+            count = 1 if cache.getInfo(coarse) else 0
+        else:
+            count = 1
+        if count:
+            count = cache.getInfo(utils.histogram(alert, clas, region))
+        if kwargs.get('recorder') is not None:
+            kwargs['recorder'].alerts(name, count)
     except Exception as e:
         msg = '{}: ERROR getting histogram - {}'.format(name, e)
         if logger:
             logger.log(msg)
+        # throttled or transient errors must not be taken as "no alerts"
+        if governor.is_retryable(e):
+            raise e
         return False
 
     if count == 0:
@@ -201,110 +457,267 @@ def _are_alerts(alert, name, date, clas, region, verbose, logger):
         return True
 
 
+def _only_new(vector, name, index, verbose=True, logger=None, **kwargs):
+    """ Keep only the features of the vector that are not in the index of
+    exported alerts (see dedup.Index). The features are compared one by one
+    while they download, so only the new ones are held in memory. Returns
+    the new features as a client side list """
+    count = [0]
+
+    def counted(features):
+        count[0] = 0
+        for feat in features:
+            count[0] += 1
+            yield feat
+
+    try:
+        new = index.new(name, counted(stream.download_features(vector)))
+    except Exception:
+        new = index.new(name, counted(governor.getInfo(vector)['features']))
+    msg = '{}: {} of {} alerts are new'.format(name, len(new), count[0])
+    if verbose:
+        print(msg)
+    if logger:
+        logger.log(msg)
+    return new
+
+
+def _destinations(destination):
+    """ List of destinations from a destination or a list of them """
+    if isinstance(destination, (list, tuple)):
+        return list(destination)
+    return [destination]
+
+
+def _folder(folder, destination):
+    """ Folder for the given destination. `folder` can be a dict with one
+    folder per destination """
+    if isinstance(folder, dict):
+        return folder.get(destination)
+    return folder
+
+
+def _inline(features, max_bytes=None):
+    """ ee.FeatureCollection made of the given client side features, or None
+    if they are too big (more than `max_bytes` of GeoJSON) to be sent in a
+    request """
+    max_bytes = max_bytes or INLINE_MAX_BYTES
+    size = 0
+    result = []
+    for feat in features:
+        size += len(json.dumps(feat))
+        if size > max_bytes:
+            return None
+        result.append(feat)
+    return ee.FeatureCollection(result)
+
+
+def _export(vector, filename, destination, folder, name, **kwargs):
+    """ Write the alerts vector to the given destination (or list of
+    destinations). If there is an index of exported alerts (`dedup_index`)
+    only new alerts are written. The local copy is written first, streamed
+    to disk, and the other destinations are uploaded from it. If it is too
+    big to be sent in a request (see INLINE_MAX_BYTES) the server side
+    vector is exported instead. Returns a list with the written outputs
+    (None for failed writes) in the order of the destinations """
+    verbose = kwargs.get('verbose', True)
+    logger = kwargs.get('logger', None)
+    index = kwargs.pop('dedup_index', None)
+    destinations = _destinations(destination)
+    features = None
+    if index is not None:
+        features = _only_new(vector, name, index, **kwargs)
+        if not features:
+            return []
+
+    local_file = None
+    remote = None
+
+    def remote_vector():
+        """ The vector to upload to the remote destinations """
+        inline = None
+        if features is not None:
+            inline = _inline(features)
+        elif local_file is not None:
+            inline = _inline(stream.read(local_file))
+        else:
+            return vector
+        if inline is None:
+            msg = '{}: too many alerts to upload from the local copy, ' \
+                  'exporting them from Earth Engine'.format(name)
+            if index is not None:
+                msg += ' (all alerts, not only the new ones)'
+            if verbose:
+                print(msg)
+            if logger:
+                logger.log(msg)
+            return vector
+        return inline
+
+    outputs = {}
+    # local first, so the other destinations can be uploaded from it
+    for dest in sorted(destinations, key=lambda d: d != 'local'):
+        dest_folder = _folder(folder, dest)
+        output = None
+        # LOCAL
+        if dest == 'local':
+            subfolders = kwargs.get('subfolders', True)
+            ext = kwargs.get('extension', 'geojson')
+            output = _toLocal(vector, filename, dest_folder, ext, subfolders,
+                              name, features=features, **kwargs)
+            if output is not None:
+                local_file = '{}.geojson{}'.format(
+                    output, stream.extension(kwargs.get('compression')))
+        else:
+            if remote is None:
+                remote = remote_vector()
+            if dest == 'drive':
+                drive_name = filename.encode().decode('ascii',
+                                                      errors='ignore')
+                ext = kwargs.get('extension', 'geojson')
+                output = _toDrive(remote, drive_name, dest_folder, ext,
+                                  **kwargs)
+
+            elif dest == 'asset':
+                output = _toAsset(remote, filename, dest_folder, **kwargs)
+
+        outputs[dest] = output
+
+    outputs = [outputs[dest] for dest in destinations]
+
+    if index is not None and None not in outputs:
+        index.add(name, features)
+        index.save()
+
+    return outputs
+
+
 def _process_period(start, end, geometry, limit, year=None,
                     eightConnected=False, useProxy=False, mask=None,
-                    destination='local', name=None, folder=None, **kwargs):
+                    destination='local', name=None, folder=None,
+                    bounds=None, simplified=None, deferMask=False,
+                    output='vector', template_cache=None, exactArea=False,
+                    **kwargs):
     verbose = kwargs.get('verbose', True)
     logger = kwargs.get('logger', None)
+    recorder = kwargs.get('recorder', None)
 
-    try:
+    def build(start, end):
         alert = FUNCTIONS['period'](start, end, geometry, limit, year,
-                                    eightConnected, useProxy, mask)
-    except Exception as e:
-        msg = 'ERROR while getting period alert {} to {}'.format(start, end)
-        if verbose:
-            print(msg)
-        if logger:
-            logger.log(msg)
-        raise e
+                                    eightConnected, useProxy, mask,
+                                    bounds=bounds, deferMask=deferMask,
+                                    exactArea=exactArea)
+        return dict(alert=alert,
+                    vector=utils.make_alerts_vector(alert, geometry,
+                                                    exactArea))
+
+    with _stage(name, 'build', recorder):
+        try:
+            if template_cache is None:
+                objects = build(start, end)
+            else:
+                key = templates.template_key(
+                    'period', geometry, limit, year, eightConnected, useProxy,
+                    mask, bounds, deferMask, exactArea)
+                objects = template_cache.get(key, build, start=start, end=end)
+            alert = ee.Image(objects['alert'])
+        except Exception as e:
+            msg = 'ERROR while getting period alert {} to {}'.format(
+                start, end)
+            if verbose:
+                print(msg)
+            if logger:
+                logger.log(msg)
+            raise e
 
     date_str = '{} to {}'.format(start, end)
 
-    are_alerts = _are_alerts(alert, name, date_str, 'both', geometry, **kwargs)
+    with _stage(name, 'check', recorder):
+        are_alerts = _are_alerts(alert, name, date_str, 'both',
+                                 simplified or geometry, **kwargs)
     if not are_alerts:
-        return None
+        return []
     
     filename = '{}_{}_to_{}'.format(name, start, end)
 
-    vector = utils.make_alerts_vector(alert, geometry)
-    # LOCAL
-    if destination == 'local':
-        subfolders = kwargs.get('subfolders', True)
-        ext = kwargs.get('extension', 'geojson')
-        _toLocal(vector, filename, folder, ext, subfolders,
-                 name, **kwargs)
+    with _stage(name, 'export', recorder):
+        if output == 'raster':
+            return _export_raster(alert, geometry, filename, destination,
+                                  folder, name, **kwargs)
 
-    elif destination == 'drive':
-        filename = filename.encode().decode('ascii', errors='ignore')
-        ext = kwargs.get('extension', 'geojson')
-        _toDrive(vector, filename, folder, ext, **kwargs)
-
-    elif destination == 'asset':
-        _toAsset(vector, filename, folder, **kwargs)
+        vector = ee.FeatureCollection(objects['vector'])
+        return _export(vector, filename, destination, folder, name,
+                       exactArea=exactArea, **kwargs)
 
 
 def _process(geometry, date, clas, limit, folder, raster_mask, destination,
-             filename,  name, **kwargs):
+             filename,  name, bounds=None, simplified=None, deferMask=False,
+             output='vector', regions=None, template_cache=None,
+             exactArea=False, **kwargs):
     verbose = kwargs.get('verbose', True)
     logger = kwargs.get('logger', None)
+    recorder = kwargs.get('recorder', None)
 
-    try:
-        alert = FUNCTIONS[clas](geometry, date, limit, mask=raster_mask)
-    except Exception as e:
-        msg = 'ERROR while getting alert for {}'.format(date)
-        if verbose:
-            print(msg)
-        if logger:
-            logger.log(msg)
-        raise e
+    def build(date):
+        alert = FUNCTIONS[clas](geometry, date, limit, mask=raster_mask,
+                                bounds=bounds, deferMask=deferMask,
+                                regions=regions, exactArea=exactArea)
+        return dict(alert=alert,
+                    vector=utils.make_alerts_vector(alert, geometry,
+                                                    exactArea))
+
+    with _stage(name, 'build', recorder):
+        try:
+            # by region, the dates are chosen client side (no template)
+            if template_cache is None or regions:
+                objects = build(date)
+            else:
+                key = templates.template_key(
+                    clas, geometry, limit, raster_mask, bounds, deferMask,
+                    exactArea)
+                objects = template_cache.get(key, build, date=date)
+            alert = ee.Image(objects['alert'])
+        except Exception as e:
+            msg = 'ERROR while getting alert for {}'.format(date)
+            if verbose:
+                print(msg)
+            if logger:
+                logger.log(msg)
+            raise e
 
     # SKIP IF EMPTY ALERT
-    are_alerts = _are_alerts(alert, name, date, clas, geometry, **kwargs)
+    with _stage(name, 'check', recorder):
+        are_alerts = _are_alerts(alert, name, date, clas,
+                                 simplified or geometry, **kwargs)
     if not are_alerts:
-        return None
-
-    vector = utils.make_alerts_vector(alert, geometry)
-    # LOCAL
-    if destination == 'local':
-        subfolders = kwargs.get('subfolders', True)
-        ext = kwargs.get('extension', 'geojson')
-        _toLocal(vector, filename, folder, ext, subfolders,
-                 name, **kwargs)
+        return []
 
-    elif destination == 'drive':
-        filename = filename.encode().decode('ascii', errors='ignore')
-        ext = kwargs.get('extension', 'geojson')
-        _toDrive(vector, filename, folder, ext, **kwargs)
+    with _stage(name, 'export', recorder):
+        if output == 'raster':
+            return _export_raster(alert, geometry, filename, destination,
+                                  folder, name, **kwargs)
 
-    elif destination == 'asset':
-        _toAsset(vector, filename, folder, **kwargs)
+        vector = ee.FeatureCollection(objects['vector'])
+        return _export(vector, filename, destination, folder, name,
+                       exactArea=exactArea, **kwargs)
 
 
-def period(site, start, end, limit, year=None, proxy=False, eightConnected=False,
-           folder=None, property_name=None, raster_mask=None,
-           destination='local', verbose=True, logger=None):
-    """ General download function for a period """   
-
-    args = dict(verbose=verbose, logger=logger)
-
-    # START PROCESS
+def _iter_sites(site, property_name=None):
+    """ Yield (name, geometry) for every site to process. The name is None
+    when the site cannot be named """
     # If it is a FeatureCollection and there is a property name
     if isinstance(site, ee.FeatureCollection) and property_name:
         names = utils.get_options(site, property_name)
-        names_cli = names.getInfo()
+        names_cli = cache.getInfo(names)
         for name in names_cli:
-
             geom = site.filterMetadata(
                 property_name, 'equals', name).first().geometry()
-
-            _process_period(start, end, geom, limit, year, eightConnected,
-                            proxy, raster_mask, destination, name, folder,
-                            **args)
+            yield name, geom
     else:
         if isinstance(site, ee.Feature) and property_name:
-            name = ee.String(site.get(property_name)).getInfo()
+            name = cache.getInfo(ee.String(site.get(property_name)))
         else:
-            name = 'N/A'
+            name = None
 
         # GET GEOMETRY
         if isinstance(site, (ee.FeatureCollection, ee.Feature)):
@@ -312,15 +725,265 @@ def period(site, start, end, limit, year=None, proxy=False, eightConnected=False
         else:
             geom = site
 
-        _process_period(start, end, geom, limit, year, eightConnected,
-                        proxy, raster_mask, destination, name, folder,
-                        **args)
+        yield name, geom
+
+
+def _list_sites(site, property_name=None, site_cache=None):
+    """ List of (name, geometry) of the sites to process (see _iter_sites).
+    If there is a site cache, the sites that are not in it are preprocessed
+    in a few combined requests (see sites.SiteCache.prefetch) instead of one
+    request per site """
+    sites_list = list(_iter_sites(site, property_name))
+    if site_cache is not None:
+        site_cache.prefetch([geom for _, geom in sites_list])
+    return sites_list
+
+
+def _site_args(geometry, site_cache=None, by_region=False):
+    """ Cheap forms of the site geometry (see sites.SiteCache) to pass to
+    _process and _process_period. If `by_region` it includes the GLAD regions
+    of the site """
+    if site_cache is None:
+        return {}
+    site = site_cache.get(geometry)
+    args = dict(bounds=site['bbox'], simplified=site['simplified'])
+    if by_region:
+        args['regions'] = site['regions']
+    return args
+
+
+def _stage(name, stage, recorder=None):
+    """ Context manager that records the duration of a stage of a site in the
+    run history, if there is a recorder (see history.Run) """
+    if recorder is None:
+        return contextlib.nullcontext()
+    return recorder.stage(name, stage)
+
+
+def _checkpointed(func, name, destination, manifest=None, retries=0,
+                  verbose=True, logger=None, recorder=None):
+    """ Process a site with `func(destinations)` recording it in the
+    manifest (see checkpoint.run) and its errors in the run history. The
+    output of every destination is recorded as soon as it is written, so a
+    retry (or a resumed run) only writes the destinations that failed and
+    does not start the export tasks that already started again. Returns the
+    outputs in the order of the destinations """
+    destinations = _destinations(destination)
+
+    def process():
+        done = manifest.outputs(name) if manifest is not None else {}
+        pending = [d for d in destinations if d not in done]
+        try:
+            outputs = func(pending) if pending else []
+            failed = []
+            for dest, output in zip(pending, outputs):
+                if output is None:
+                    failed.append(dest)
+                elif manifest is not None:
+                    manifest.written(name, dest, output)
+                    done[dest] = output
+            if manifest is not None and failed:
+                raise RuntimeError('could not write to {}'.format(
+                    ', '.join(failed)))
+        except Exception as e:
+            if recorder is not None:
+                recorder.error(name, e)
+            raise e
+        if manifest is None:
+            return outputs
+        return [done[d] for d in destinations if d in done]
+
+    return checkpoint.run(process, name, manifest, retries, logger=logger,
+                          verbose=verbose)
+
+
+def _run_jobs(jobs, workers=1):
+    """ Run the given jobs (functions without arguments) in order or, with
+    many workers, up to `workers` of them at the same time (threads). Errors
+    are raised after all the jobs are done """
+    if workers <= 1:
+        for job in jobs:
+            job()
+        return
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(job) for job in jobs]
+    for future in futures:
+        future.result()
+
+
+def _candidates(sites_list, date, site_cache, verbose=True, logger=None):
+    """ Keep only the sites (list of (name, geometry)) whose bounding box
+    intersects the footprint of the GLAD images of the given date, using an
+    R-tree of the cached site bounding boxes (see sites.STRtree) """
+    items = []
+    for i, (name, geom) in enumerate(sites_list):
+        bbox = site_cache.info(geom)['bbox']
+        items.append((sites.bbox_of(bbox), i))
+    tree = sites.STRtree(items)
+
+    collection = ee.ImageCollection(utils.ASSET_ID)
+    footprints = cache.getInfo(sites.footprints(collection, date))
+    keep = set()
+    for footprint in footprints:
+        keep.update(tree.query(sites.bbox_of(footprint)))
+
+    msg = '{} of {} sites intersect the GLAD images of {}'.format(
+        len(keep), len(sites_list), date)
+    if verbose:
+        print(msg)
+    if logger:
+        logger.log(msg)
+    return [sites_list[i] for i in sorted(keep)]
+
+
+def _filename(basename, date, name):
+    if name is None:
+        return '{}_{}'.format(basename, date)
+    return '{}_{}_{}'.format(basename, date, name)
+
+
+def _basename(clas):
+    if clas == 'both':
+        return 'alerts_for'
+    return '{}_alerts_for'.format(clas)
+
+
+def period(site, start, end, limit, year=None, proxy=False, eightConnected=False,
+           folder=None, property_name=None, raster_mask=None,
+           destination='local', verbose=True, logger=None, site_cache=None,
+           defer_mask=False, dedup_index=None, manifest=None, retries=0,
+           page_size=None, compression=None, output='vector',
+           precheck_scale=None, postprocess=False, template_cache=None,
+           recorder=None, exact_area=False, workers=1):
+    """ General download function for a period
+
+    :param site_cache: if given, the bounding box and simplified geometry of
+        each site are used to filter the collection and check for alerts
+    :type site_cache: sites.SiteCache
+    :param defer_mask: apply the raster mask once to the difference of the
+        compared images instead of to every image (see alerts.period)
+    :param dedup_index: if given, export only the alerts that are not in
+        this index (or whose class changed)
+    :type dedup_index: dedup.Index
+    :param manifest: if given, sites already done are skipped and the status
+        and outputs of every site are recorded in it. Retries (and resumed
+        runs) only write the destinations that failed
+    :type manifest: checkpoint.Manifest
+    :param retries: number of times a failed site is retried
+    :param destination: 'local', 'drive' or 'asset', or a list of them. With
+        many destinations the alerts are computed and fetched only once
+    :param folder: the folder, or a dict with one folder per destination
+    :param page_size: if given, local downloads fetch the alerts in pages of
+        this number of features. Every page computes the alerts again, so
+        use it only for sites that do not fit in one download
+    :param compression: compression for local files. One of None, 'gzip' or
+        'zstd'
+    :param output: 'vector' to export the vectorized alerts or 'raster' to
+        export the alerts image (class, area and date bands) as a tiled
+        GeoTIFF, skipping the vectorization
+    :param precheck_scale: if given, check for alerts at this (coarse) scale
+        first, and compute the full resolution histogram only for sites that
+        have alerts at that scale. The check is lossy, sites with small
+        alerts can be skipped (see utils.has_alerts)
+    :param postprocess: if True, local files are dissolved, simplified and
+        quantized after the download (see postprocess.py, needs shapely)
+    :param template_cache: if given, the graph of each site is built and
+        serialized once and reused with other dates
+    :type template_cache: templates.Templates
+    :param recorder: if given, the duration of every stage of each site, the
+        alert pixels, the bytes written and the errors are recorded in it
+    :type recorder: history.Run
+    :param exact_area: if True, the area of the alerts (area band and
+        area_m2) is the exact area of each cluster of alerts, at the cost of
+        one extra vectorization per site (see utils.exact_area)
+    :param workers: number of sites processed at the same time
+    """
+
+    args = dict(verbose=verbose, logger=logger, deferMask=defer_mask,
+                dedup_index=dedup_index, page_size=page_size,
+                compression=compression, output=output,
+                precheck_scale=precheck_scale, postprocess=postprocess,
+                template_cache=template_cache, recorder=recorder,
+                exactArea=exact_area)
+
+    def jobs():
+        for name, geom in _list_sites(site, property_name, site_cache):
+            name = name or 'N/A'
+
+            def process(destinations, name=name, geom=geom):
+                site_args = _site_args(geom, site_cache)
+                return _process_period(start, end, geom, limit, year,
+                                       eightConnected, proxy, raster_mask,
+                                       destinations, name, folder,
+                                       **site_args, **args)
+
+            yield functools.partial(_checkpointed, process, name, destination,
+                                    manifest, retries, verbose, logger,
+                                    recorder)
+
+    # START PROCESS
+    _run_jobs(jobs(), workers)
 
 
 def download(site, date, clas, limit, folder=None, property_name=None,
-             raster_mask=None, destination='local', verbose=True, logger=None):
-    """ General download function """
-    if not utils.has_image(date, alerts.ALERTS).getInfo():
+             raster_mask=None, destination='local', verbose=True, logger=None,
+             site_cache=None, defer_mask=False, dedup_index=None,
+             manifest=None, retries=0, page_size=None, compression=None,
+             output='vector', precheck_scale=None, site_index=False,
+             by_region=False, postprocess=False, check_image=True,
+             template_cache=None, recorder=None, exact_area=False,
+             workers=1):
+    """ General download function
+
+    :param site_cache: if given, the bounding box and simplified geometry of
+        each site are used to filter the collection and check for alerts
+    :type site_cache: sites.SiteCache
+    :param defer_mask: apply the raster mask once to the difference of the
+        compared images instead of to every image (see alerts.period)
+    :param dedup_index: if given, export only the alerts that are not in
+        this index (or whose class changed)
+    :type dedup_index: dedup.Index
+    :param manifest: if given, sites already done are skipped and the status
+        and outputs of every site are recorded in it. Retries (and resumed
+        runs) only write the destinations that failed
+    :type manifest: checkpoint.Manifest
+    :param retries: number of times a failed site is retried
+    :param destination: 'local', 'drive' or 'asset', or a list of them. With
+        many destinations the alerts are computed and fetched only once
+    :param folder: the folder, or a dict with one folder per destination
+    :param page_size: if given, local downloads fetch the alerts in pages of
+        this number of features. Every page computes the alerts again, so
+        use it only for sites that do not fit in one download
+    :param compression: compression for local files. One of None, 'gzip' or
+        'zstd'
+    :param output: 'vector' to export the vectorized alerts or 'raster' to
+        export the alerts image (class, area and date bands) as a tiled
+        GeoTIFF, skipping the vectorization
+    :param precheck_scale: if given, check for alerts at this (coarse) scale
+        first, and compute the full resolution histogram only for sites that
+        have alerts at that scale. The check is lossy, sites with small
+        alerts can be skipped (see utils.has_alerts)
+    :param site_index: if True (and there is a site_cache), only the sites
+        that intersect the GLAD images of the date are processed
+    :param by_region: if True (and there is a site_cache), the last two dates
+        of each GLAD region of the site are compared (see alerts.oneday)
+    :param postprocess: if True, local files are dissolved, simplified and
+        quantized after the download (see postprocess.py, needs shapely)
+    :param template_cache: if given, the graph of each site is built and
+        serialized once and reused with other dates
+    :type template_cache: templates.Templates
+    :param recorder: if given, the duration of every stage of each site, the
+        alert pixels, the bytes written and the errors are recorded in it
+    :type recorder: history.Run
+    :param exact_area: if True, the area of the alerts (area band and
+        area_m2) is the exact area of each cluster of alerts, at the cost of
+        one extra vectorization per site (see utils.exact_area)
+    :param check_image: if False, do not check that there are GLAD images for
+        the given date
+    :param workers: number of sites processed at the same time
+    """
+    if check_image and \
+            not cache.getInfo(utils.has_image(date, alerts.ALERTS)):
         msg = 'GLAD alerts not available for date {}'.format(date)
         if logger:
             logger.log(msg)
@@ -330,39 +993,143 @@ def download(site, date, clas, limit, folder=None, property_name=None,
         clas = 'both'
 
     # BASE NAME FOR OUTPUT FILE
-    if clas == 'both':
-        basename = 'alerts_for'
-    else:
-        basename = '{}_alerts_for'.format(clas)
-
-    args = dict(verbose=verbose, logger=logger)
+    basename = _basename(clas)
+
+    args = dict(verbose=verbose, logger=logger, deferMask=defer_mask,
+                dedup_index=dedup_index, page_size=page_size,
+                compression=compression, output=output,
+                precheck_scale=precheck_scale, postprocess=postprocess,
+                template_cache=template_cache, recorder=recorder,
+                exactArea=exact_area)
+
+    sites_list = _list_sites(site, property_name, site_cache)
+    if site_index and site_cache is not None:
+        sites_list = _candidates(sites_list, date, site_cache, verbose,
+                                 logger)
+
+    def jobs():
+        for name, geom in sites_list:
+            filename = _filename(basename, date, name)
+            name = name or 'N/A'
+
+            def process(destinations, name=name, geom=geom,
+                        filename=filename):
+                site_args = _site_args(geom, site_cache, by_region)
+                return _process(geom, date, clas, limit, folder, raster_mask,
+                                destinations, filename, name, **site_args,
+                                **args)
+
+            yield functools.partial(_checkpointed, process, name, destination,
+                                    manifest, retries, verbose, logger,
+                                    recorder)
 
     # START PROCESS
-    # If it is a FeatureCollection and there is a property name
-    if isinstance(site, ee.FeatureCollection) and property_name:
-        names = utils.get_options(site, property_name)
-        names_cli = names.getInfo()
-        for name in names_cli:
-            filename = '{}_{}_{}'.format(basename, date, name)
+    _run_jobs(jobs(), workers)
+
+
+def backfill(site, start, end, clas, limit, run_id=None, resume=False,
+             workers=BACKFILL_WORKERS, verbose=True, logger=None,
+             recorder=None, **kwargs):
+    """ Process every GLAD date from start to end (inclusive) as `download`
+    does for one date, running up to `workers` dates at the same time. The
+    available dates are taken once from the collection metadata (see
+    alerts.date_index). Other keyword arguments are passed to `download`
+
+    :param run_id: if given, every date gets its own manifest with ID
+        `{run_id}_{date}` (see checkpoint.Manifest)
+    :param resume: resume the manifests of a previous run with the same ID
+    :param recorder: if given, the figures of every date are recorded in its
+        own window of the run (see history.Run.window)
+    :type recorder: history.Run
+    :return: a dict with the summary of the manifest of each date (or the
+        error that stopped it)
+    """
+    dates = alerts.dates(start, end)
+    msg = '{} GLAD dates from {} to {}'.format(len(dates), start, end)
+    if verbose:
+        print(msg)
+    if logger:
+        logger.log(msg)
 
-            geom = site.filterMetadata(
-                property_name, 'equals', name).first().geometry()
+    def window(date):
+        manifest = None
+        if run_id:
+            manifest = checkpoint.Manifest('{}_{}'.format(run_id, date),
+                                           resume=resume)
+        download(site, date, clas, limit, verbose=verbose, logger=logger,
+                 manifest=manifest, check_image=False,
+                 recorder=recorder.window(date) if recorder else None,
+                 **kwargs)
+        return manifest.summary() if manifest is not None else {}
+
+    results = {}
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [(date, executor.submit(window, date)) for date in dates]
+        for date, future in futures:
+            try:
+                results[date] = future.result()
+            except Exception as e:
+                msg = '{}: ERROR - {}'.format(date, e)
+                if verbose:
+                    print(msg)
+                if logger:
+                    logger.log(msg)
+                results[date] = {'error': str(e)}
+    return results
 
-            _process(geom, date, clas, limit, folder, raster_mask, destination,
-                     filename,  name, **args)
-    else:
-        if isinstance(site, ee.Feature) and property_name:
-            name = ee.String(site.get(property_name)).getInfo()
-            filename = '{}_{}_{}'.format(basename, date, name)
-        else:
-            name = 'N/A'
-            filename = '{}_{}'.format(basename, date)
 
-        # GET GEOMETRY
-        if isinstance(site, (ee.FeatureCollection, ee.Feature)):
-            geom = site.geometry()
-        else:
-            geom = site
+def plan(site, start, end, property_name=None, destination='local'):
+    """ Estimate the work needed to compute the alerts of a period without
+    running it. Returns a list of dicts (one per site) with the keys of
+    `utils.estimate` and:
 
-        _process(geom, date, clas, limit, folder, raster_mask, destination,
-                 filename,  name, **args)
+    - name: the name of the site
+    - scale: the nominal scale of the GLAD alerts
+    - tasks: number of export tasks (drive or asset)
+    - downloads: number of downloads (local)
+    - requests: estimated number of requests to Earth Engine
+    - warnings: list of reasons why the site is likely to fail
+    """
+    collection = alerts.get_alerts()
+    first = ee.ImageCollection(utils.ASSET_ID).first()
+    scale = cache.getInfo(first.projection().nominalScale())
+
+    plans = []
+    for name, geom in _iter_sites(site, property_name):
+        estimate = utils.estimate(geom, collection, start, end, scale)
+        estimate = cache.getInfo(estimate)
+        estimate['name'] = name or 'N/A'
+        estimate['scale'] = scale
+
+        exports = 1 if estimate['images'] > 1 else 0
+        destinations = _destinations(destination)
+        remote = len([d for d in destinations if d != 'local'])
+        estimate['tasks'] = exports * remote
+        estimate['downloads'] = exports if 'local' in destinations else 0
+        # histogram + exports/downloads (+ asset roots for asset)
+        requests = 1 + estimate['tasks'] + estimate['downloads']
+        if 'asset' in destinations:
+            requests += exports
+        estimate['requests'] = requests
+
+        warnings = []
+        if estimate['images'] < 2:
+            warnings.append('less than 2 images in the period')
+        if estimate['pixels'] > PLAN_MAX_PIXELS:
+            warnings.append('more than {:.0e} pixels'.format(PLAN_MAX_PIXELS))
+        estimate['warnings'] = warnings
+        plans.append(estimate)
+
+    return plans
+
+
+async def period_async(*args, concurrency=aio.CONCURRENCY, **kwargs):
+    """ Same as `period` but processes up to `concurrency` sites at the same
+    time without blocking the event loop. Use it with `asyncio.run` """
+    return await aio.run(period, *args, workers=concurrency, **kwargs)
+
+
+async def download_async(*args, concurrency=aio.CONCURRENCY, **kwargs):
+    """ Same as `download` but processes up to `concurrency` sites at the
+    same time without blocking the event loop. Use it with `asyncio.run` """
+    return await aio.run(download, *args, workers=concurrency, **kwargs)
@@ -0,0 +1,118 @@
+# coding=utf-8
+
+""" Memoization of Earth Engine computations. Results of `getInfo` are stored
+by the hash of the serialized graph, so identical computations are evaluated
+only once. Entries expire when a new GLAD image is published """
+
+import ee
+import hashlib
+import json
+import os
+import threading
+from . import utils, governor
+
+
+def graph_key(obj):
+    """ Unique key for the given ee.ComputedObject, given by the SHA-256 of
+    its serialized graph """
+    serialized = ee.serializer.toJSON(obj)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def glad_version():
+    """ ID of the latest GLAD image. Used to invalidate cached results """
+    collection = ee.ImageCollection(utils.ASSET_ID)
+    latest = collection.sort('system:time_start', False).first()
+    return governor.getInfo(latest.id())
+
+
+class Cache(object):
+    """ Cache for `getInfo` results of pure computations
+
+    :param folder: if given, results are also stored on disk in this folder
+        (one JSON file per computation) so they survive across runs
+    :param version: the version of the cached results. If None it will be
+        fetched (once) with `glad_version` on first use
+    """
+    def __init__(self, folder=None, version=None):
+        self.folder = folder
+        self._version = version
+        self._memory = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self):
+        if self._version is None:
+            self._version = glad_version()
+        return self._version
+
+    def refresh(self):
+        """ Fetch the GLAD version again. If a new image has been published
+        all cached results become stale """
+        self._version = None
+
+    def clear(self):
+        """ Clear the in-memory results """
+        with self._lock:
+            self._memory = {}
+
+    def stats(self):
+        """ Hit and miss counts """
+        return dict(hits=self.hits, misses=self.misses)
+
+    def _path(self, key):
+        return os.path.join(self.folder, '{}.json'.format(key))
+
+    def _read(self, key):
+        if key in self._memory:
+            return self._memory[key]
+        if self.folder:
+            path = self._path(key)
+            if os.path.isfile(path):
+                with open(path, 'r') as f:
+                    entry = json.load(f)
+                return entry['version'], entry['value']
+        return None
+
+    def _write(self, key, version, value):
+        self._memory[key] = (version, value)
+        if self.folder:
+            if not os.path.isdir(self.folder):
+                os.makedirs(self.folder)
+            with open(self._path(key), 'w') as f:
+                json.dump(dict(version=version, value=value), f)
+
+    def getInfo(self, obj):
+        """ Evaluate the given ee.ComputedObject, or return the cached result
+        if the same computation has already been evaluated for the current
+        GLAD version """
+        key = graph_key(obj)
+        version = self.version
+        with self._lock:
+            entry = self._read(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                self._memory[key] = entry
+                return entry[1]
+            self.misses += 1
+
+        value = governor.getInfo(obj)
+
+        with self._lock:
+            self._write(key, version, value)
+        return value
+
+
+CACHE = Cache()
+
+
+def getInfo(obj):
+    """ Evaluate the given object using the default cache """
+    return CACHE.getInfo(obj)
+
+
+def stats():
+    """ Hit and miss counts of the default cache """
+    return CACHE.stats()
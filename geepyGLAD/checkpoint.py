@@ -0,0 +1,134 @@
+# coding=utf-8
+
+""" Run checkpoints. A manifest records the status and outputs of every site
+of a run (and of every destination of a site), so an interrupted run can be
+resumed """
+
+import datetime
+import json
+import os
+import threading
+import time
+
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Manifest(object):
+    """ Per-run manifest stored as a JSON file
+
+    :param run_id: unique ID of the run. The CLI uses the SHA-256 of the
+        config file and the command
+    :param folder: folder to store the manifests
+    :param resume: if False, a previous manifest of the same run is discarded
+    """
+    def __init__(self, run_id, folder='runs', resume=True):
+        self.run_id = run_id
+        self._lock = threading.Lock()
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.path = os.path.join(folder, '{}.json'.format(run_id))
+        if resume and os.path.isfile(self.path):
+            with open(self.path, 'r') as f:
+                self._sites = json.load(f)
+        else:
+            self._sites = {}
+
+    def status(self, name):
+        """ Status of the given site (None if it was never processed) """
+        return self._sites.get(str(name), {}).get('status')
+
+    def done(self, name):
+        """ True if the given site was successfully processed """
+        return self.status(name) == DONE
+
+    def attempts(self, name):
+        """ Number of times the given site has been processed """
+        return self._sites.get(str(name), {}).get('attempts', 0)
+
+    def outputs(self, name):
+        """ Outputs already written for the given site, by destination """
+        return dict(self._sites.get(str(name), {}).get('destinations', {}))
+
+    def written(self, name, destination, output):
+        """ Record the output of one destination of the given site, so it is
+        not written again if the site is retried or resumed """
+        destinations = self.outputs(name)
+        destinations[destination] = output
+        self._update(name, destinations=destinations)
+
+    def _update(self, name, **kwargs):
+        with self._lock:
+            site = self._sites.setdefault(str(name), {'attempts': 0})
+            site.update(kwargs)
+            site['time'] = datetime.datetime.today().isoformat()
+            self._save()
+
+    def complete(self, name, outputs=None):
+        """ Record the given site as done with its outputs """
+        self._update(name, status=DONE, outputs=outputs or [], error=None,
+                     attempts=self.attempts(name) + 1)
+
+    def fail(self, name, error):
+        """ Record the given site as failed """
+        self._update(name, status=FAILED, error=str(error),
+                     attempts=self.attempts(name) + 1)
+
+    def summary(self):
+        """ Number of sites by status """
+        result = {}
+        for site in self._sites.values():
+            status = site.get('status')
+            result[status] = result.get(status, 0) + 1
+        return result
+
+    def _save(self):
+        tmp = '{}.tmp'.format(self.path)
+        with open(tmp, 'w') as f:
+            json.dump(self._sites, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+def run(func, name, manifest=None, retries=0, backoff=2, logger=None,
+        verbose=True):
+    """ Process a site calling `func()`. If a manifest is given, sites that
+    are already done are skipped, the result is recorded and errors are
+    retried `retries` times waiting `backoff ** attempt` seconds between
+    attempts. Without a manifest, errors are raised """
+    if manifest is not None and manifest.done(name):
+        msg = '{}: already processed, skipping'.format(name)
+        if verbose:
+            print(msg)
+        if logger:
+            logger.log(msg)
+        return None
+
+    attempt = 0
+    while True:
+        try:
+            outputs = func()
+        except Exception as e:
+            if attempt < retries:
+                wait = backoff ** attempt
+                msg = '{}: ERROR - {}. Retrying in {} seconds'.format(
+                    name, e, wait)
+                if verbose:
+                    print(msg)
+                if logger:
+                    logger.log(msg)
+                time.sleep(wait)
+                attempt += 1
+                continue
+            if manifest is None:
+                raise e
+            manifest.fail(name, e)
+            msg = '{}: FAILED - {}'.format(name, e)
+            if verbose:
+                print(msg)
+            if logger:
+                logger.log(msg)
+            return None
+        else:
+            if manifest is not None:
+                manifest.complete(name, outputs)
+            return outputs
@@ -0,0 +1,120 @@
+# coding=utf-8
+
+""" Index of exported alerts, to export only new alerts (or alerts whose class
+changed) across overlapping runs """
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+# decimals used to compare geometries (about 1 cm)
+PRECISION = 7
+
+
+def _round(coords, precision=PRECISION):
+    if isinstance(coords, (list, tuple)):
+        return [_round(c, precision) for c in coords]
+    return round(coords, precision)
+
+
+def geometry_hash(geometry):
+    """ Hash of a GeoJSON geometry. Coordinates are rounded so the same
+    polygon exported twice gets the same hash """
+    geom = dict(type=geometry['type'],
+                coordinates=_round(geometry.get('coordinates', [])))
+    serialized = json.dumps(geom, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def alert_date(properties):
+    """ Value of the alertDateYY property of an exported alert """
+    for key, value in properties.items():
+        if key.startswith('alertDate'):
+            return value
+    return None
+
+
+def feature_key(feature):
+    """ Key (alertDate and geometry hash) of a GeoJSON feature """
+    date = alert_date(feature.get('properties', {}))
+    return '{}|{}'.format(date, geometry_hash(feature['geometry']))
+
+
+def _is_sqlite(path):
+    with open(path, 'rb') as f:
+        return f.read(16) == b'SQLite format 3\x00'
+
+
+class Index(object):
+    """ Local index of exported alerts. For every site it holds the class of
+    each exported alert, keyed by alert date and geometry hash. It is stored
+    in a SQLite database, so registering the alerts of a site only writes
+    those alerts. An index in the old JSON format is imported (once) into a
+    database with the same name and the `.sqlite` extension
+
+    :param path: path of the database that holds the index
+    """
+    def __init__(self, path='exported_alerts.sqlite'):
+        legacy = None
+        if os.path.isfile(path) and not _is_sqlite(path):
+            legacy = path
+            path = '{}.sqlite'.format(os.path.splitext(path)[0])
+            # already imported
+            if os.path.isfile(path):
+                legacy = None
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS alerts (site TEXT, key TEXT, '
+                'class TEXT, PRIMARY KEY (site, key))')
+        if legacy:
+            with open(legacy, 'r') as f:
+                index = json.load(f)
+            with self._lock, self._db:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO alerts VALUES (?, ?, ?)',
+                    [(site, key, clas) for site, alerts in index.items()
+                     for key, clas in alerts.items()])
+
+    def new(self, site, features):
+        """ Return the features that have not been exported for the given
+        site, or whose class changed since the last export. `features` can
+        be a stream (see stream.download_features): the lock is only taken
+        for each lookup, so other sites are not blocked while it downloads
+        """
+        site = str(site)
+        result = []
+        for feat in features:
+            clas = feat.get('properties', {}).get('class')
+            key = feature_key(feat)
+            with self._lock:
+                row = self._db.execute(
+                    'SELECT class FROM alerts WHERE site = ? AND key = ?',
+                    (site, key)).fetchone()
+            if row is None or row[0] != clas:
+                result.append(feat)
+        return result
+
+    def add(self, site, features):
+        """ Register the given features as exported for the given site. They
+        are written to disk with `save` """
+        site = str(site)
+        rows = [(site, feature_key(feat),
+                 feat.get('properties', {}).get('class'))
+                for feat in features]
+        with self._lock:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO alerts VALUES (?, ?, ?)', rows)
+
+    def save(self):
+        """ Write the registered alerts to disk """
+        with self._lock:
+            self._db.commit()
+
+    def close(self):
+        self.save()
+        self._db.close()
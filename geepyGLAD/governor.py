@@ -0,0 +1,218 @@
+# coding=utf-8
+
+""" Request governor for Earth Engine. Every request goes through a token
+bucket (requests per second) and an adaptive concurrency limit that is
+halved when Earth Engine throttles and increased slowly while requests
+succeed (AIMD). Retryable errors are retried with exponential backoff """
+
+import re
+import threading
+import time
+
+# messages (lowercase) of errors caused by throttling
+THROTTLING = [
+    'too many concurrent aggregations',
+    'too many requests',
+    'rate limit',
+    'quota exceeded',
+]
+
+# messages (lowercase) of other transient errors
+TRANSIENT = [
+    'deadline exceeded',
+    'timed out',
+    'service unavailable',
+    'internal error',
+    'connection reset',
+    'connection aborted',
+]
+
+# HTTP status codes of throttling and other transient errors
+THROTTLING_STATUS = [429]
+TRANSIENT_STATUS = [500, 502, 503, 504]
+
+# HTTP status code in an error message (for example "<HttpError 429 when
+# requesting ...>"), only as a whole token, so "over 5000 elements" is not
+# taken as a 500
+STATUS_RE = re.compile(r'(?<![\w.])([45]\d\d)(?![\w.])')
+
+
+def status_of(error):
+    """ HTTP status code of the given error, or None. It is taken from the
+    error (googleapiclient and requests errors) or, for errors that only
+    carry a message (ee.EEException), from an `HttpError <code>` or
+    `status <code>` in it """
+    for holder, attr in [('resp', 'status'), ('response', 'status_code'),
+                         (None, 'status_code')]:
+        obj = getattr(error, holder, None) if holder else error
+        status = getattr(obj, attr, None)
+        if isinstance(status, int):
+            return status
+        if isinstance(status, str) and status.isdigit():
+            return int(status)
+    match = re.search(r'(?:httperror|status|code)\W{0,3}' +
+                      STATUS_RE.pattern, str(error).lower())
+    if match:
+        return int(match.group(1))
+    return None
+
+
+def _has(msg, messages):
+    return any(re.search(r'\b{}\b'.format(re.escape(m)), msg)
+               for m in messages)
+
+
+def is_throttling(error):
+    """ True if the error was caused by Earth Engine throttling """
+    if status_of(error) in THROTTLING_STATUS:
+        return True
+    return _has(str(error).lower(), THROTTLING)
+
+
+def is_retryable(error):
+    """ True if the request that raised the error can be retried """
+    if is_throttling(error) or status_of(error) in TRANSIENT_STATUS:
+        return True
+    return _has(str(error).lower(), TRANSIENT)
+
+
+class Governor(object):
+    """ Central limiter for Earth Engine requests
+
+    :param rate: requests per second allowed by the token bucket
+    :param burst: size of the token bucket
+    :param concurrency: initial number of requests in flight
+    :param min_concurrency: lower bound of the concurrency limit
+    :param max_concurrency: upper bound of the concurrency limit
+    :param retries: number of retries for retryable errors
+    :param backoff: base of the exponential backoff (seconds)
+    """
+    def __init__(self, rate=10., burst=10, concurrency=4, min_concurrency=1,
+                 max_concurrency=32, retries=5, backoff=2):
+        self.rate = float(rate)
+        self.burst = burst
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._limit = float(concurrency)
+        self._active = 0
+        self._cond = threading.Condition()
+
+        self.counters = dict(requests=0, succeeded=0, throttled=0,
+                             retried=0, failed=0)
+
+    @property
+    def concurrency(self):
+        """ Current concurrency limit """
+        return int(self._limit)
+
+    def _count(self, name):
+        self.counters[name] += 1
+
+    def _acquire(self):
+        """ Wait for a free slot and a token """
+        with self._cond:
+            while self._active >= int(self._limit):
+                self._cond.wait()
+            self._active += 1
+
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens +
+                                   (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    break
+                self._cond.wait((1 - self._tokens) / self.rate)
+
+    def _release(self, throttled=False):
+        with self._cond:
+            self._active -= 1
+            if throttled:
+                # multiplicative decrease
+                self._limit = max(self.min_concurrency, self._limit / 2)
+            else:
+                # additive increase (about 1 per `limit` requests)
+                self._limit = min(self.max_concurrency,
+                                  self._limit + 1 / self._limit)
+            self._cond.notify_all()
+
+    def call(self, func, *args, **kwargs):
+        """ Call `func(*args, **kwargs)` (a function that sends a request to
+        Earth Engine) under the limits of the governor """
+        return self._call(func, args, kwargs, is_retryable)
+
+    def submit(self, func, *args, **kwargs):
+        """ Like `call` for requests that are not idempotent (starting an
+        export task). Only throttling errors are retried, because the request
+        was rejected. After a timeout or a server error the task may have been
+        started, so the error is raised instead of starting it twice """
+        return self._call(func, args, kwargs, is_throttling)
+
+    def _call(self, func, args, kwargs, retryable):
+        attempt = 0
+        while True:
+            self._acquire()
+            with self._cond:
+                self._count('requests')
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttling(e)
+                self._release(throttled)
+                with self._cond:
+                    if throttled:
+                        self._count('throttled')
+                    if retryable(e) and attempt < self.retries:
+                        self._count('retried')
+                    else:
+                        self._count('failed')
+                        raise e
+                time.sleep(self.backoff ** attempt)
+                attempt += 1
+            else:
+                self._release()
+                with self._cond:
+                    self._count('succeeded')
+                return result
+
+    def getInfo(self, obj):
+        """ Evaluate the given ee.ComputedObject under the limits of the
+        governor """
+        return self.call(obj.getInfo)
+
+    def stats(self):
+        """ Counters and current concurrency limit """
+        with self._cond:
+            stats = dict(self.counters)
+            stats['concurrency'] = self.concurrency
+        return stats
+
+
+GOVERNOR = Governor()
+
+
+def call(func, *args, **kwargs):
+    """ Call the given function using the default governor """
+    return GOVERNOR.call(func, *args, **kwargs)
+
+
+def submit(func, *args, **kwargs):
+    """ Call the given non idempotent function using the default governor
+    """
+    return GOVERNOR.submit(func, *args, **kwargs)
+
+
+def getInfo(obj):
+    """ Evaluate the given object using the default governor """
+    return GOVERNOR.getInfo(obj)
+
+
+def stats():
+    """ Counters of the default governor """
+    return GOVERNOR.stats()
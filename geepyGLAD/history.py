@@ -0,0 +1,203 @@
+# coding=utf-8
+
+""" Run history. Every run is recorded in a local SQLite database with the
+duration of each stage of each site, the number of alert pixels, the bytes
+written and the errors, so trends can be queried across runs. A run that
+processes many GLAD dates (backfill) records every date as a separate window
+(see Run.window), so the figures of a site are kept for each date """
+
+import contextlib
+import datetime
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    command TEXT,
+    config_hash TEXT,
+    started TEXT,
+    finished TEXT,
+    status TEXT
+);
+CREATE TABLE IF NOT EXISTS stages (
+    run INTEGER REFERENCES runs(id),
+    site TEXT,
+    date TEXT NOT NULL DEFAULT '',
+    stage TEXT,
+    seconds REAL
+);
+CREATE TABLE IF NOT EXISTS sites (
+    run INTEGER REFERENCES runs(id),
+    site TEXT,
+    date TEXT NOT NULL DEFAULT '',
+    alerts INTEGER,
+    bytes INTEGER DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (run, site, date)
+);
+"""
+
+# databases created before the `date` column
+MIGRATION = """
+ALTER TABLE stages ADD COLUMN date TEXT NOT NULL DEFAULT '';
+ALTER TABLE sites RENAME TO sites_old;
+{sites}
+INSERT INTO sites (run, site, alerts, bytes, error)
+    SELECT run, site, alerts, bytes, error FROM sites_old;
+DROP TABLE sites_old;
+"""
+
+
+def percentile(values, p):
+    """ Nearest-rank percentile `p` (0-100) of the given values """
+    values = sorted(values)
+    if not values:
+        return None
+    rank = max(1, int(-(-p * len(values) // 100)))
+    return values[rank - 1]
+
+
+class History(object):
+    """ SQLite database of runs
+
+    :param path: path of the database file
+    """
+    def __init__(self, path='history.sqlite'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._migrate()
+            self._db.executescript(SCHEMA)
+
+    def _migrate(self):
+        columns = [row[1] for row in
+                   self._db.execute('PRAGMA table_info(sites)').fetchall()]
+        if columns and 'date' not in columns:
+            sites = SCHEMA[SCHEMA.index('CREATE TABLE IF NOT EXISTS sites'):]
+            self._db.executescript(MIGRATION.format(sites=sites))
+
+    def execute(self, sql, params=()):
+        """ Execute a statement and return all the rows """
+        with self._lock, self._db:
+            return self._db.execute(sql, params).fetchall()
+
+    def start(self, command, config_hash=None):
+        """ Record a new run and return its Run """
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                'INSERT INTO runs (command, config_hash, started) '
+                'VALUES (?, ?, ?)',
+                (command, config_hash, datetime.datetime.today().isoformat()))
+        return Run(self, cursor.lastrowid)
+
+    def close(self):
+        self._db.close()
+
+    # QUERIES
+    def slowest_sites(self, limit=10):
+        """ Sites with the highest mean duration per run (and window): list
+        of (site, mean seconds, number of runs and windows) """
+        return self.execute(
+            'SELECT site, AVG(total), COUNT(*) FROM ('
+            '  SELECT run, date, site, SUM(seconds) AS total FROM stages'
+            '  GROUP BY run, date, site) '
+            'GROUP BY site ORDER BY AVG(total) DESC LIMIT ?', (limit,))
+
+    def stage_percentiles(self, p=95):
+        """ Percentile `p` of the duration of every stage: list of
+        (stage, seconds, number of records) """
+        durations = {}
+        for stage, seconds in self.execute(
+                'SELECT stage, seconds FROM stages'):
+            durations.setdefault(stage, []).append(seconds)
+        return [(stage, percentile(values, p), len(values))
+                for stage, values in sorted(durations.items())]
+
+    def alert_growth(self):
+        """ Alert pixels and bytes written per day of run: list of
+        (date, alerts, bytes, number of runs) """
+        return self.execute(
+            'SELECT substr(runs.started, 1, 10) AS day, SUM(sites.alerts), '
+            '       SUM(sites.bytes), COUNT(DISTINCT runs.id) '
+            'FROM runs JOIN sites ON sites.run = runs.id '
+            'GROUP BY day ORDER BY day')
+
+    def windows(self, run=None):
+        """ Figures of every window (GLAD date) of the runs that processed
+        many dates, or only of the given run: list of (run, date, alerts,
+        bytes, sites, errors, seconds) """
+        where = 'WHERE sites.date != \'\''
+        params = ()
+        if run is not None:
+            where += ' AND sites.run = ?'
+            params = (run,)
+        return self.execute(
+            'SELECT sites.run, sites.date, SUM(sites.alerts), '
+            '       SUM(sites.bytes), COUNT(*), COUNT(sites.error), '
+            '       (SELECT SUM(seconds) FROM stages WHERE '
+            '        stages.run = sites.run AND stages.date = sites.date) '
+            'FROM sites {} GROUP BY sites.run, sites.date '
+            'ORDER BY sites.run, sites.date'.format(where), params)
+
+
+class Run(object):
+    """ Recorder of a single run (see History.start). The figures are
+    recorded for the given window (GLAD date), if any (see Run.window) """
+    def __init__(self, history, run_id, date=''):
+        self.history = history
+        self.id = run_id
+        self.date = date
+
+    def window(self, date):
+        """ Recorder of the same run for the window of the given GLAD date
+        """
+        return Run(self.history, self.id, str(date))
+
+    def _site(self, site):
+        self.history.execute(
+            'INSERT OR IGNORE INTO sites (run, site, date) VALUES (?, ?, ?)',
+            (self.id, str(site), self.date))
+
+    @contextlib.contextmanager
+    def stage(self, site, stage):
+        """ Context manager that records the duration of a stage of a site
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.history.execute(
+                'INSERT INTO stages (run, site, date, stage, seconds) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (self.id, str(site), self.date, stage,
+                 time.perf_counter() - start))
+
+    def alerts(self, site, count):
+        """ Record the number of alert pixels of a site """
+        self._site(site)
+        self.history.execute(
+            'UPDATE sites SET alerts = ? WHERE run = ? AND site = ? '
+            'AND date = ?', (count, self.id, str(site), self.date))
+
+    def written(self, site, nbytes):
+        """ Add the bytes written for a site """
+        self._site(site)
+        self.history.execute(
+            'UPDATE sites SET bytes = bytes + ? WHERE run = ? AND site = ? '
+            'AND date = ?', (nbytes, self.id, str(site), self.date))
+
+    def error(self, site, error):
+        """ Record the error of a site """
+        self._site(site)
+        self.history.execute(
+            'UPDATE sites SET error = ? WHERE run = ? AND site = ? '
+            'AND date = ?', (str(error), self.id, str(site), self.date))
+
+    def finish(self, status='done'):
+        """ Record the end of the run """
+        self.history.execute(
+            'UPDATE runs SET finished = ?, status = ? WHERE id = ?',
+            (datetime.datetime.today().isoformat(), status, self.id))
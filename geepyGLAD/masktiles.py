@@ -0,0 +1,180 @@
+# coding=utf-8
+
+""" Local tile cache for raster masks (typically a forest mask). The mask is
+fetched (or imported) once, resampled to the GLAD grid and stored in tiles
+of 1 bit per pixel. Tiles are read by memory map, so a pixel or a tile can be
+read without loading the whole mask. Needs numpy (pip install numpy) """
+
+import math
+import os
+from . import governor
+
+# GLAD grid: EPSG:4326 with pixels of 0.00025 degrees
+CRS = 'EPSG:4326'
+SCALE = 0.00025
+# pixels per tile side (one degree). Must be a multiple of 8
+TILE_SIZE = 4000
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('the mask tile cache needs the numpy package '
+                          '(pip install numpy)')
+    return numpy
+
+
+def tile_of(lon, lat, scale=SCALE, tile_size=TILE_SIZE):
+    """ (tx, ty, column, row) of the tile and the pixel in the tile that
+    holds the given point """
+    col = int(math.floor((lon + 180) / scale))
+    row = int(math.floor((90 - lat) / scale))
+    tx, cx = divmod(col, tile_size)
+    ty, cy = divmod(row, tile_size)
+    return tx, ty, cx, cy
+
+
+def tiles_of(bbox, scale=SCALE, tile_size=TILE_SIZE):
+    """ List of (tx, ty) of the tiles that cover the given bounding box
+    (xmin, ymin, xmax, ymax) """
+    xmin, ymin, xmax, ymax = bbox
+    tx0, ty0, _, _ = tile_of(xmin, ymax, scale, tile_size)
+    tx1, ty1, _, _ = tile_of(xmax, ymin, scale, tile_size)
+    return [(tx, ty) for ty in range(ty0, ty1 + 1)
+            for tx in range(tx0, tx1 + 1)]
+
+
+def tile_origin(tx, ty, scale=SCALE, tile_size=TILE_SIZE):
+    """ (west, north) coordinates of the given tile """
+    size = scale * tile_size
+    return tx * size - 180, 90 - ty * size
+
+
+class TileCache(object):
+    """ Bit-packed tiles of a mask on the GLAD grid
+
+    :param name: name of the mask, typically its asset ID
+    :param folder: folder to store the tiles. A subfolder is made for each
+        mask
+    :param scale: pixel size (degrees)
+    :param tile_size: pixels per tile side (multiple of 8)
+    """
+    def __init__(self, name, folder='masktiles', scale=SCALE,
+                 tile_size=TILE_SIZE):
+        if tile_size % 8:
+            raise ValueError('tile_size must be a multiple of 8')
+        self.name = name
+        self.scale = scale
+        self.tile_size = tile_size
+        self.folder = os.path.join(folder, name.replace('/', '_'))
+        self._maps = {}
+
+    def path(self, tx, ty):
+        return os.path.join(self.folder, '{}_{}.bin'.format(tx, ty))
+
+    def has(self, tx, ty):
+        """ True if the given tile is in the cache """
+        return os.path.isfile(self.path(tx, ty))
+
+    def put(self, tx, ty, array):
+        """ Store a tile given as a 2D array (tile_size x tile_size). Non
+        zero values are inside the mask """
+        np = _numpy()
+        array = np.asarray(array)
+        if array.shape != (self.tile_size, self.tile_size):
+            raise ValueError('tile must be {0}x{0}, got {1}'.format(
+                self.tile_size, array.shape))
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        path = self.path(tx, ty)
+        tmp = '{}.tmp'.format(path)
+        np.packbits(array != 0, axis=1).tofile(tmp)
+        os.replace(tmp, path)
+        self._maps.pop((tx, ty), None)
+
+    def packed(self, tx, ty):
+        """ Memory map of the packed tile (rows of tile_size / 8 bytes), or
+        None if the tile is not in the cache """
+        key = (tx, ty)
+        if key not in self._maps:
+            if not self.has(tx, ty):
+                return None
+            np = _numpy()
+            self._maps[key] = np.memmap(
+                self.path(tx, ty), dtype=np.uint8, mode='r',
+                shape=(self.tile_size, self.tile_size // 8))
+        return self._maps[key]
+
+    def tile(self, tx, ty):
+        """ Boolean 2D array of the given tile, or None if it is not in the
+        cache """
+        packed = self.packed(tx, ty)
+        if packed is None:
+            return None
+        return _numpy().unpackbits(packed, axis=1).astype(bool)
+
+    def value(self, lon, lat):
+        """ True if the given point is inside the mask. None if its tile is
+        not in the cache """
+        tx, ty, cx, cy = tile_of(lon, lat, self.scale, self.tile_size)
+        packed = self.packed(tx, ty)
+        if packed is None:
+            return None
+        return bool((packed[cy, cx // 8] >> (7 - cx % 8)) & 1)
+
+    def fetch(self, tx, ty, image):
+        """ Fetch the given tile of the mask (ee.Image) from Earth Engine,
+        resampled to the GLAD grid, and store it """
+        np = _numpy()
+        import ee
+        west, north = tile_origin(tx, ty, self.scale, self.tile_size)
+        expression = ee.Image(image).select([0]).gt(0).unmask(0).toByte() \
+                       .rename('mask')
+        request = {
+            'expression': expression,
+            'fileFormat': 'NUMPY_NDARRAY',
+            'grid': {
+                'dimensions': {'width': self.tile_size,
+                               'height': self.tile_size},
+                'affineTransform': {'scaleX': self.scale, 'shearX': 0,
+                                    'translateX': west, 'shearY': 0,
+                                    'scaleY': -self.scale,
+                                    'translateY': north},
+                'crsCode': CRS
+            }
+        }
+        result = governor.call(ee.data.computePixels, request)
+        self.put(tx, ty, np.asarray(result['mask']))
+
+    def ensure(self, bbox, image):
+        """ Fetch the missing tiles that cover the given bounding box (xmin,
+        ymin, xmax, ymax). Returns the number of fetched tiles """
+        missing = [t for t in tiles_of(bbox, self.scale, self.tile_size)
+                   if not self.has(*t)]
+        for tx, ty in missing:
+            self.fetch(tx, ty, image)
+        return len(missing)
+
+    def import_array(self, array, west, north):
+        """ Store a mask given as a 2D array on the GLAD grid whose top left
+        corner is (west, north). Both must be on a tile corner. Pixels of the
+        border tiles beyond the array are stored as outside the mask. Returns
+        the number of stored tiles """
+        np = _numpy()
+        array = np.asarray(array)
+        tx0, ty0, cx, cy = tile_of(west + self.scale / 2.,
+                                   north - self.scale / 2.,
+                                   self.scale, self.tile_size)
+        if cx or cy:
+            raise ValueError('(west, north) must be the corner of a tile')
+        size = self.tile_size
+        count = 0
+        for row in range(0, array.shape[0], size):
+            for col in range(0, array.shape[1], size):
+                tile = np.zeros((size, size), dtype=bool)
+                part = array[row:row + size, col:col + size]
+                tile[:part.shape[0], :part.shape[1]] = part != 0
+                self.put(tx0 + col // size, ty0 + row // size, tile)
+                count += 1
+        return count
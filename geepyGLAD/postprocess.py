@@ -0,0 +1,148 @@
+# coding=utf-8
+
+""" Local post-processing of downloaded alerts: dissolve adjacent polygons
+with the same class and dates, coverage simplification (adjacent polygons
+keep sharing their edges) and coordinate quantization. Needs shapely (pip
+install shapely), version 2.1 or newer to simplify """
+
+import os
+from . import stream
+
+# GLAD alerts nominal scale (m)
+SCALE = 30
+# meters per degree (at the equator)
+DEGREE = 111320.
+# default simplification tolerance: half a pixel, in degrees
+TOLERANCE = SCALE / 2. / DEGREE
+# default number of decimals of the coordinates (about 1 cm)
+PRECISION = 7
+# default number of features processed at once
+BATCH_SIZE = 10000
+
+# properties that must be equal to dissolve two polygons
+KEYS = ('class', 'start_period', 'end_period')
+# prefixes of the date properties that must be equal to dissolve two polygons
+DATE_PREFIXES = ('alertDate', 'confirmedDate', 'probableDate')
+
+
+def _shapely():
+    try:
+        from shapely import geometry, ops
+    except ImportError:
+        raise ImportError('post-processing needs the shapely package '
+                          '(pip install shapely)')
+    return geometry, ops
+
+
+def simplify(shapes, tolerance=TOLERANCE):
+    """ Simplify the given polygons (shapely) as a coverage, so the edges
+    shared by adjacent polygons are simplified once and the result has no
+    gaps or overlaps (shapely.coverage_simplify). With shapely older than 2.1
+    the polygons are returned as they are """
+    import shapely
+    coverage_simplify = getattr(shapely, 'coverage_simplify', None)
+    if not shapes or not tolerance or coverage_simplify is None:
+        return list(shapes)
+    return list(coverage_simplify(shapes, tolerance))
+
+
+def group_key(properties):
+    """ Key of the properties that must be equal to dissolve two alerts """
+    values = [properties.get(k) for k in KEYS]
+    for key in sorted(properties):
+        if key.startswith(DATE_PREFIXES):
+            values.append((key, properties[key]))
+    return tuple(values)
+
+
+def quantize(coords, precision=PRECISION):
+    """ Round the given (nested) coordinates """
+    if isinstance(coords, (list, tuple)):
+        return [quantize(c, precision) for c in coords]
+    return round(coords, precision)
+
+
+def dissolve(features, tolerance=TOLERANCE, precision=PRECISION,
+             exact_area=False):
+    """ Dissolve, simplify and quantize the given features (list of GeoJSON
+    features). Yields the new features. All the dissolved polygons are
+    simplified together (see simplify).
+
+    :param exact_area: if True, the `area_m2` of the features is the area of
+        the whole cluster they belong to (see utils.make_alerts_vector), so
+        the `area_m2` of a dissolved polygon is the one of its parts.
+        Otherwise it is the sum of the areas of its parts
+    """
+    geometry, ops = _shapely()
+
+    groups = {}
+    for feat in features:
+        key = group_key(feat.get('properties', {}))
+        groups.setdefault(key, []).append(feat)
+
+    parts = []
+    properties = []
+    for members in groups.values():
+        shapes = [geometry.shape(f['geometry']) for f in members]
+        union = ops.unary_union(shapes)
+        for part in getattr(union, 'geoms', [union]):
+            props = dict(members[0].get('properties', {}))
+            if 'area_m2' in props:
+                areas = [f['properties'].get('area_m2', 0)
+                         for f, s in zip(members, shapes)
+                         if part.intersects(s.representative_point())]
+                props['area_m2'] = max(areas) if exact_area else sum(areas)
+            parts.append(part)
+            properties.append(props)
+
+    for simple, props in zip(simplify(parts, tolerance), properties):
+        geom = geometry.mapping(simple)
+        yield {
+            'type': 'Feature',
+            'geometry': {'type': geom['type'],
+                         'coordinates': quantize(geom['coordinates'],
+                                                 precision)},
+            'properties': props
+        }
+
+
+def process(path, output=None, tolerance=TOLERANCE, precision=PRECISION,
+            batch_size=BATCH_SIZE, compression=None, exact_area=False):
+    """ Post-process a (compressed) GeoJSON file of alerts, reading and
+    writing it as a stream in batches of `batch_size` features. Polygons are
+    only dissolved and simplified together within a batch. If `output` is
+    None the file is replaced. `exact_area` as in dissolve. Returns a dict
+    with the number of features and bytes before and after """
+    replace = output is None
+    if replace:
+        output = '{}.tmp'.format(path)
+    compression = compression or stream.compression_of(path)
+
+    # fail before creating the output if shapely is missing
+    _shapely()
+
+    count = 0
+    batch = []
+    try:
+        with stream.FeatureWriter(output, compression) as writer:
+            for feat in stream.read(path):
+                count += 1
+                batch.append(feat)
+                if len(batch) >= batch_size:
+                    for new in dissolve(batch, tolerance, precision,
+                                        exact_area):
+                        writer.write(new)
+                    batch = []
+            for new in dissolve(batch, tolerance, precision, exact_area):
+                writer.write(new)
+    except Exception:
+        if replace and os.path.isfile(output):
+            os.remove(output)
+        raise
+
+    report = dict(features_in=count, features_out=writer.count,
+                  bytes_in=os.path.getsize(path),
+                  bytes_out=os.path.getsize(output))
+    if replace:
+        os.replace(output, path)
+    return report
@@ -0,0 +1,257 @@
+# coding=utf-8
+
+""" Site preprocessing. For every site it computes (once) a simplified
+geometry, its bounding box and the GLAD regions it intersects. The cheap
+forms are used to filter collections and the exact geometry only to clip the
+final results. Preprocessed sites expire when the asset of the sites is
+updated (see asset_version) or after a maximum age """
+
+import ee
+import json
+import os
+import threading
+import time
+from . import utils, cache, governor, aio
+
+# default error tolerance (m) for the simplified geometry (one GLAD pixel)
+MAX_ERROR = 30
+# default number of sites described in a single request (see prefetch)
+PREFETCH_SIZE = 50
+# default maximum age (s) of a preprocessed site (the GLAD regions change)
+MAX_AGE = 7 * 24 * 3600
+
+
+def region_of(image_id):
+    """ GLAD region of the given image ID (MM_DD_REGION) """
+    return '_'.join(image_id.split('_')[2:])
+
+
+def asset_version(asset_id):
+    """ Update time of the given asset, used as the version of its
+    preprocessed sites. None if it cannot be read """
+    try:
+        asset = governor.call(ee.data.getAsset, asset_id)
+    except Exception:
+        return None
+    return asset.get('updateTime')
+
+
+def describe(geometry, maxError=MAX_ERROR):
+    """ Server side dictionary with the simplified geometry, the bounding box
+    and the GLAD regions that intersect the given geometry """
+    simplified = geometry.simplify(maxError)
+    bbox = geometry.bounds(maxError)
+    ids = ee.ImageCollection(utils.ASSET_ID).filterBounds(bbox) \
+            .aggregate_array('system:index')
+    regions = ids.map(
+        lambda i: ee.List(ee.String(i).split('_')).slice(2).join('_'))
+    return ee.Dictionary(dict(simplified=simplified, bbox=bbox,
+                              regions=ee.List(regions).distinct().sort()))
+
+
+class SiteCache(object):
+    """ Cache of preprocessed sites
+
+    :param folder: if given, the preprocessed sites are also stored on disk
+        (one JSON file per site) so they survive across runs
+    :param maxError: error tolerance (m) for the simplified geometry
+    :param version: version of the sites (for example the update time of
+        their asset, see asset_version). Sites preprocessed with another
+        version are preprocessed again
+    :param max_age: sites preprocessed more than this number of seconds ago
+        are preprocessed again. None to keep them until the version changes
+    """
+    def __init__(self, folder=None, maxError=MAX_ERROR, version=None,
+                 max_age=MAX_AGE):
+        self.folder = folder
+        self.maxError = maxError
+        self.version = version
+        self.max_age = max_age
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def versioned(self, version):
+        """ The same cache (it shares the stored sites) for the sites of the
+        given version """
+        other = SiteCache(self.folder, self.maxError, version, self.max_age)
+        other._memory = self._memory
+        other._lock = self._lock
+        return other
+
+    def _key(self, geometry):
+        return '{}_{}'.format(cache.graph_key(geometry), self.maxError)
+
+    def _path(self, key):
+        return os.path.join(self.folder, '{}.json'.format(key))
+
+    def _valid(self, entry):
+        if entry.get('version') != self.version:
+            return False
+        if self.max_age is None:
+            return True
+        return time.time() - entry.get('saved', 0) < self.max_age
+
+    def _load(self, key):
+        entry = self._memory.get(key)
+        if entry is None and self.folder:
+            path = self._path(key)
+            if os.path.isfile(path):
+                with open(path, 'r') as f:
+                    entry = json.load(f)
+        # entries without `info` were written before the versions
+        if entry is None or 'info' not in entry or not self._valid(entry):
+            return None
+        self._memory[key] = entry
+        return entry['info']
+
+    def _save(self, key, info):
+        entry = dict(version=self.version, saved=time.time(), info=info)
+        self._memory[key] = entry
+        if self.folder:
+            if not os.path.isdir(self.folder):
+                os.makedirs(self.folder)
+            with open(self._path(key), 'w') as f:
+                json.dump(entry, f)
+
+    def info(self, geometry):
+        """ Client side preprocessed info (GeoJSON geometries) of the given
+        site geometry """
+        key = self._key(geometry)
+        with self._lock:
+            info = self._load(key)
+        if info is None:
+            info = governor.getInfo(describe(geometry, self.maxError))
+            with self._lock:
+                self._save(key, info)
+        return info
+
+    def prefetch(self, geometries, size=PREFETCH_SIZE,
+                 concurrency=aio.CONCURRENCY):
+        """ Preprocess the given site geometries that are not in the cache.
+        `size` sites are described in a single request (see aio.combine) and
+        up to `concurrency` of those requests are in flight at the same time
+        (see aio.gather), instead of one request per site. Returns the number
+        of preprocessed sites """
+        missing = {}
+        with self._lock:
+            for geometry in geometries:
+                key = self._key(geometry)
+                if key not in missing and self._load(key) is None:
+                    missing[key] = geometry
+        if not missing:
+            return 0
+
+        keys = list(missing)
+        chunks = [keys[i:i + size] for i in range(0, len(keys), size)]
+        requests = [ee.Dictionary({key: describe(missing[key], self.maxError)
+                                   for key in chunk}) for chunk in chunks]
+        results = aio.evaluate(requests, concurrency)
+        with self._lock:
+            for result in results:
+                for key, info in result.items():
+                    self._save(key, info)
+        return len(keys)
+
+    def get(self, geometry):
+        """ Preprocessed site. Returns a dict with:
+
+        - geometry: the exact geometry (the one given)
+        - simplified: the simplified geometry
+        - bbox: the bounding box
+        - regions: list of GLAD regions that intersect the site
+        """
+        info = self.info(geometry)
+        return dict(geometry=geometry,
+                    simplified=ee.Geometry(info['simplified']),
+                    bbox=ee.Geometry(info['bbox']),
+                    regions=info['regions'])
+
+
+CACHE = SiteCache()
+
+
+def bbox_of(geometry):
+    """ (xmin, ymin, xmax, ymax) of a GeoJSON geometry """
+    def points(coords):
+        if isinstance(coords[0], (list, tuple)):
+            for c in coords:
+                for p in points(c):
+                    yield p
+        else:
+            yield coords
+    xs, ys = zip(*[p[:2] for p in points(geometry['coordinates'])])
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def intersects(a, b):
+    """ True if the bounding boxes a and b intersect """
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _union(boxes):
+    xmin, ymin, xmax, ymax = zip(*boxes)
+    return min(xmin), min(ymin), max(xmax), max(ymax)
+
+
+class STRtree(object):
+    """ R-tree packed with the Sort-Tile-Recursive algorithm. It is built once
+    and only supports queries
+
+    :param items: list of (bbox, value) where bbox is (xmin, ymin, xmax, ymax)
+    :param capacity: number of children per node
+    """
+    def __init__(self, items, capacity=10):
+        self.capacity = capacity
+        # a node is (bbox, children, leaf)
+        nodes = [(bbox, value, True) for bbox, value in items]
+        while len(nodes) > capacity:
+            nodes = self._pack(nodes)
+        if nodes:
+            self.root = (_union([n[0] for n in nodes]), nodes, False)
+        else:
+            self.root = None
+
+    def _pack(self, nodes):
+        """ Pack one level of nodes into parent nodes """
+        capacity = self.capacity
+        parents = -(-len(nodes) // capacity)
+        slices = int(parents ** 0.5) or 1
+        per_slice = -(-len(nodes) // slices)
+
+        def center(i):
+            return lambda n: (n[0][i] + n[0][i + 2]) / 2.
+
+        nodes = sorted(nodes, key=center(0))
+        packed = []
+        for s in range(0, len(nodes), per_slice):
+            column = sorted(nodes[s:s + per_slice], key=center(1))
+            for c in range(0, len(column), capacity):
+                children = column[c:c + capacity]
+                packed.append(
+                    (_union([n[0] for n in children]), children, False))
+        return packed
+
+    def query(self, bbox):
+        """ Values whose bounding box intersects the given one """
+        result = []
+        if self.root is None:
+            return result
+        stack = [self.root]
+        while stack:
+            box, children, leaf = stack.pop()
+            if not intersects(box, bbox):
+                continue
+            if leaf:
+                result.append(children)
+            else:
+                stack.extend(children)
+        return result
+
+
+def footprints(collection, date):
+    """ Server side list of the bounding boxes (GeoJSON polygons) of the
+    images of the collection for the given date """
+    date = ee.Date(date)
+    images = collection.filterDate(date, date.advance(1, 'day'))
+    return images.toList(images.size()).map(
+        lambda img: ee.Image(img).geometry().bounds())
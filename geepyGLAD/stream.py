@@ -0,0 +1,269 @@
+# coding=utf-8
+
+""" Streaming of feature collections. Features are fetched in pages and
+written as they arrive (optionally compressed), so memory stays flat
+regardless of the number of alerts """
+
+import codecs
+import ee
+import functools
+import gzip
+import io
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from . import governor
+
+# default number of features per page
+PAGE_SIZE = 1000
+# default number of pages in flight
+WORKERS = 4
+# bytes read at once when parsing a file
+CHUNK_SIZE = 2**16
+
+EXTENSIONS = {
+    'gzip': 'gz',
+    'zstd': 'zst'
+}
+
+
+def extension(compression):
+    """ File extension suffix for the given compression ('' if None) """
+    if not compression:
+        return ''
+    if compression not in EXTENSIONS:
+        raise ValueError('compression must be one of {}'.format(
+            list(EXTENSIONS.keys())))
+    return '.{}'.format(EXTENSIONS[compression])
+
+
+def compression_of(path):
+    """ Compression of the given file guessed by its extension """
+    for compression, ext in EXTENSIONS.items():
+        if path.endswith('.{}'.format(ext)):
+            return compression
+    return None
+
+
+def open_file(path, mode='r', compression=None):
+    """ Open a (compressed) text file. If compression is None it is guessed
+    from the extension """
+    compression = compression or compression_of(path)
+    if compression == 'gzip':
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('zstd compression needs the zstandard package '
+                              '(pip install zstandard)')
+        raw = open(path, mode + 'b')
+        if mode == 'w':
+            binary = zstandard.ZstdCompressor().stream_writer(raw)
+        else:
+            binary = zstandard.ZstdDecompressor().stream_reader(raw)
+        return io.TextIOWrapper(binary, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def compress(path, compression):
+    """ Compress the given file as a stream and remove the original. Returns
+    the path of the compressed file """
+    if not compression:
+        return path
+    compressed = '{}{}'.format(path, extension(compression))
+    with open(path, 'r', encoding='utf-8') as src:
+        with open_file(compressed, 'w', compression) as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    os.remove(path)
+    return compressed
+
+
+class FeatureWriter(object):
+    """ Write a GeoJSON FeatureCollection one feature at a time. Use it as a
+    context manager:
+
+    with FeatureWriter('alerts.geojson') as writer:
+        for feat in features:
+            writer.write(feat)
+
+    :param compression: one of None, 'gzip' or 'zstd'. The file is compressed
+        while it is written
+
+    If an error is raised while writing, the partial file is removed
+    """
+    def __init__(self, path, compression=None):
+        self.path = path
+        self.compression = compression
+        self.count = 0
+        self._file = None
+
+    def __enter__(self):
+        self._file = open_file(self.path, 'w', self.compression)
+        self._file.write('{"type": "FeatureCollection", "features": [\n')
+        return self
+
+    def write(self, feature):
+        """ Write a feature (dict) """
+        if self.count:
+            self._file.write(',\n')
+        self._file.write(json.dumps(feature))
+        self.count += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # a partial file must not look like a valid (complete) one
+        if exc_type is None:
+            self._file.write('\n]}\n')
+        self._file.close()
+        if exc_type is not None and os.path.isfile(self.path):
+            os.remove(self.path)
+        return False
+
+
+def page(collection, size, offset):
+    """ Client side list of `size` features of the collection starting at
+    `offset` """
+    features = collection.toList(size, offset)
+    return governor.getInfo(ee.FeatureCollection(features))['features']
+
+
+def pages(collection, page_size=PAGE_SIZE, workers=WORKERS):
+    """ Fetch the features of the collection in pages of `page_size`
+    features, with up to `workers` pages in flight at once. Yields the pages
+    (lists of features) in order. Every page (and the size) evaluates the
+    whole collection again, so it is only worth it for collections that do
+    not fit in one request (see `download_features`) """
+    total = governor.getInfo(collection.size())
+    offsets = list(range(0, total, page_size))
+
+    with ThreadPoolExecutor(workers) as executor:
+        pending = []
+        for offset in offsets:
+            pending.append(
+                executor.submit(page, collection, page_size, offset))
+            if len(pending) >= workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def features(collection, page_size=PAGE_SIZE, workers=WORKERS):
+    """ Yield the features of the collection one by one, fetching them in
+    pages (see `pages`) """
+    for p in pages(collection, page_size, workers):
+        for feat in p:
+            yield feat
+
+
+def toGeoJSON(collection, path, page_size=PAGE_SIZE, workers=WORKERS,
+              compression=None):
+    """ Download the collection to a GeoJSON file page by page. Returns the
+    number of written features """
+    with FeatureWriter(path, compression) as writer:
+        for feat in features(collection, page_size, workers):
+            writer.write(feat)
+    return writer.count
+
+
+def parse(chunks):
+    """ Parse the features of a GeoJSON FeatureCollection incrementally from
+    an iterable of text chunks. Yields the features one by one, holding at
+    most one feature (plus a chunk) in memory """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    started = False
+    eof = False
+
+    while True:
+        if not started:
+            key = buf.find('"features"')
+            bracket = buf.find('[', key) if key >= 0 else -1
+            if bracket >= 0:
+                buf = buf[bracket + 1:]
+                started = True
+                continue
+        else:
+            buf = buf.lstrip().lstrip(',').lstrip()
+            if buf.startswith(']'):
+                return
+            if buf:
+                try:
+                    feature, end = decoder.raw_decode(buf)
+                except ValueError:
+                    if eof:
+                        raise
+                else:
+                    buf = buf[end:]
+                    yield feature
+                    continue
+        if eof:
+            return
+        chunk = next(chunks, '')
+        if not chunk:
+            eof = True
+        buf += chunk
+
+
+def decode(chunks, encoding='utf-8'):
+    """ Decode an iterable of byte chunks into text chunks. Multi-byte
+    characters split between chunks are handled """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+def iter_features(fileobj, chunk_size=CHUNK_SIZE):
+    """ Parse the features of a GeoJSON FeatureCollection from a text file
+    object incrementally (see `parse`) """
+    return parse(iter(functools.partial(fileobj.read, chunk_size), ''))
+
+
+def get(url):
+    """ Open a streamed GET request to the given URL under the limits of the
+    governor (see governor.call). An error status raises
+    requests.HTTPError, so throttling and transient statuses are retried """
+    import requests
+
+    def request():
+        response = requests.get(url, stream=True)
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
+        return response
+    return governor.call(request)
+
+
+def download(url, chunk_size=CHUNK_SIZE):
+    """ Yield the features of the GeoJSON FeatureCollection at the given URL
+    while it downloads, without holding the whole response in memory """
+    response = get(url)
+    try:
+        for feat in parse(decode(response.iter_content(chunk_size))):
+            yield feat
+    finally:
+        response.close()
+
+
+def download_features(collection, chunk_size=CHUNK_SIZE):
+    """ Yield the features of the collection one by one while they download
+    in a single request (see `download`) """
+    url = governor.call(collection.getDownloadURL, 'geojson')
+    for feat in download(url, chunk_size):
+        yield feat
+
+
+def read(path, compression=None):
+    """ Yield the features of a (compressed) GeoJSON file without loading the
+    whole file in memory """
+    with open_file(path, 'r', compression) as f:
+        for feat in iter_features(f):
+            yield feat
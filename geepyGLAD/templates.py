@@ -0,0 +1,110 @@
+# coding=utf-8
+
+""" Templates of serialized alert graphs. The graph of a site (alerts image
+and vector) only changes with the dates, so it is built and serialized once
+with placeholder dates and then the dates are replaced in the serialized
+graph """
+
+import ee
+import hashlib
+import json
+import os
+import threading
+from . import cache
+from ._version import __version__
+
+
+def placeholder(name):
+    """ Placeholder string for the parameter with the given name """
+    return '__geepyGLAD_{}__'.format(name)
+
+
+def template_key(*parts):
+    """ Unique key for the given parts. Earth Engine objects are replaced by
+    the hash of their serialized graph (see cache.graph_key) """
+    def serializable(part):
+        if isinstance(part, ee.ComputedObject):
+            return cache.graph_key(part)
+        return repr(part)
+    parts = [__version__] + [serializable(p) for p in parts]
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+class Templates(object):
+    """ Cache of serialized graph templates
+
+    :param folder: if given, templates are also stored on disk (one JSON file
+        per template) so they survive across runs
+    """
+    def __init__(self, folder=None):
+        self.folder = folder
+        self._memory = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """ Hit and miss counts """
+        return dict(hits=self.hits, misses=self.misses)
+
+    def _path(self, key):
+        return os.path.join(self.folder, '{}.json'.format(key))
+
+    def _load(self, key):
+        if key in self._memory:
+            return self._memory[key]
+        if self.folder:
+            path = self._path(key)
+            if os.path.isfile(path):
+                with open(path, 'r') as f:
+                    return json.load(f)
+        return None
+
+    def _save(self, key, template):
+        self._memory[key] = template
+        if self.folder:
+            if not os.path.isdir(self.folder):
+                os.makedirs(self.folder)
+            with open(self._path(key), 'w') as f:
+                json.dump(template, f)
+
+    def get(self, key, build, **params):
+        """ Objects built by `build` for the given parameters
+
+        :param key: unique key of the graph without the parameters (see
+            template_key)
+        :param build: function that takes the parameters as keyword
+            arguments and returns a dict of Earth Engine objects. It must not
+            use the values of the parameters client side
+        :param params: the parameters (strings)
+        :return: a dict with the same keys as the one returned by `build`.
+            The values are ee.ComputedObject, cast them to the right type
+        """
+        with self._lock:
+            template = self._load(key)
+            if template is not None:
+                self.hits += 1
+                self._memory[key] = template
+        if template is None:
+            objects = build(**{name: placeholder(name) for name in params})
+            template = {name: ee.serializer.toJSON(obj)
+                        for name, obj in objects.items()}
+            with self._lock:
+                self.misses += 1
+                self._save(key, template)
+
+        result = {}
+        for name, serialized in template.items():
+            for param, value in params.items():
+                serialized = serialized.replace(
+                    json.dumps(placeholder(param)), json.dumps(value))
+            result[name] = ee.deserializer.fromJSON(serialized)
+        return result
+
+
+TEMPLATES = Templates()
+
+
+def stats():
+    """ Hit and miss counts of the default templates cache """
+    return TEMPLATES.stats()
@@ -6,6 +6,8 @@ import ee
 from geetools import tools
 import math
 
+ASSET_ID = 'projects/glad/alert/UpdResult'
+
 
 def cleanup_sa19(collection):
     """ South America alerts for 2019 have an image that should not be
@@ -23,7 +25,7 @@ def cleanup_sa19(collection):
 def get_days(month, year, collection=None):
     """ Get days available for the given month and year """
     if collection is None:
-        collection = cleanup_sa19(ee.ImageCollection('projects/glad/alert/UpdResult'))
+        collection = cleanup_sa19(ee.ImageCollection(ASSET_ID))
 
     def wrap(img):
         d = img.date()
@@ -69,6 +71,34 @@ def get_pixel_limit(area, scale):
     return area.divide(scale.multiply(scale)).floor()
 
 
+def estimate(geometry, collection, start, end, scale=30, tile_size=256):
+    """ Estimate the size of the computation of alerts over the given
+    geometry and period. Returns a server side dictionary with:
+
+    - area: area of the geometry (m2)
+    - pixels: number of pixels of the geometry at the given scale
+    - bbox_pixels: number of pixels of the bounding box of the geometry
+    - tiles: number of tiles (of tile_size x tile_size pixels) that cover the
+      bounding box
+    - images: number of images of the collection in the period
+    """
+    start = ee.Date(start)
+    end = ee.Date(end).advance(1, 'day')
+    scale = ee.Number(scale)
+
+    area = geometry.area(1)
+    bbox_area = geometry.bounds(1).area(1)
+    pixel_area = scale.multiply(scale)
+    pixels = area.divide(pixel_area).ceil()
+    bbox_pixels = bbox_area.divide(pixel_area).ceil()
+    tiles = bbox_pixels.divide(tile_size * tile_size).ceil()
+    images = collection.filterBounds(geometry).filterDate(start, end).size()
+
+    return ee.Dictionary(dict(area=area, pixels=pixels,
+                              bbox_pixels=bbox_pixels, tiles=tiles,
+                              images=images))
+
+
 def get_rid_min_area(bool_image, limit):
     """ Get rid of 'islands' and 'holes' less than the given limit param.
 
@@ -125,6 +155,66 @@ def get_rid_islands(bool_image, limit, scale=30, eightConnected=False):
     return no_island.addBands(finalarea)
 
 
+def get_rid_islands_both(probable, confirmed, limit, eightConnected=False):
+    """ Same as `get_rid_islands` for the probable and confirmed images at
+    once. Both classes are labeled in a single connected pixel count over a
+    class image (1 probable, 2 confirmed), so only pixels of the same class
+    are connected.
+
+    :param probable: boolean image of probable alerts
+    :param confirmed: boolean image of confirmed alerts. It must not overlap
+        the probable alerts
+    :param limit: all islands less than this limit (m2) will be erased
+    :return: the cleaned probable and confirmed bands (same names) and the
+        'area' band
+    """
+    area = ee.Image.pixelArea().rename('area')
+    limit = ee.Number(limit)
+
+    classes = probable.add(confirmed.multiply(2)).selfMask()
+    conn = classes.connectedPixelCount(512, eightConnected)
+    finalarea = area.multiply(conn)
+
+    # get islands (masked pixels are not alerts)
+    island = finalarea.lte(limit).unmask(0)
+
+    # get rid island
+    probable = probable.where(island, 0)
+    confirmed = confirmed.where(island, 0)
+
+    finalarea = finalarea.updateMask(probable.Or(confirmed)).unmask()
+
+    return probable.addBands([confirmed, finalarea.rename('area')])
+
+
+def exact_area(classes, region, eightConnected=False):
+    """ Exact area (m2) of every connected component of the given class image
+    (see get_rid_islands_both), without the 512 pixels limit of
+    connectedPixelCount. The components are vectorized and their area is
+    painted back, so the cost is one extra vectorization of the region
+
+    :param classes: masked class image (0 values must be masked)
+    :param region: the region to compute
+    :return: an image with the 'area' band
+    """
+    # in the projection of the classes, as make_vector
+    clusters = classes.reduceToVectors(**{
+        'geometry': region,
+        'scale': classes.projection().nominalScale(),
+        'geometryType': 'polygon',
+        'eightConnected': eightConnected,
+        'labelProperty': 'class',
+        'maxPixels': 1e13
+    })
+    clusters = clusters.map(lambda feat: feat.set('area',
+                                                  feat.geometry().area(1)))
+    # reduceToImage has the default projection, keep the one of the classes
+    # so all the bands of the alerts have the same projection
+    area = clusters.reduceToImage(['area'], ee.Reducer.first()) \
+        .reproject(classes.projection())
+    return area.updateMask(classes.mask()).rename('area')
+
+
 def smooth(image, algorithm='max'):
     """ Get the smooth algorithms given its name """
     algs = {
@@ -137,11 +227,9 @@ def smooth(image, algorithm='max'):
     return result.set('system:time_start', image.date().millis())
 
 
-def histogram(alert, clas, region=None):
-    """ Return the number of pixels equal one in the given region """
-    if not region:
-        region = alert.geometry()
-
+def class_image(alert, clas):
+    """ Image (band 'result') that is 1 where the given alert has the given
+    class ('probable', 'confirmed' or 'both') """
     if clas == 'both':
         conf = alert.select('confirmed\d{2}').unmask()
         prob = alert.select('probable\d{2}').unmask()
@@ -149,11 +237,51 @@ def histogram(alert, clas, region=None):
     else:
         pattern = '{}\d{{2}}'.format(clas)
         image = alert.select(pattern).rename('result')
+    return image
+
+
+def has_alerts(alert, clas, region=None, scale=1000):
+    """ Cheap check for alerts in the given region. Computes the max of the
+    given class at a coarse scale, so Earth Engine reads the inputs from the
+    pyramid levels and never touches the full resolution pixels. It is lossy:
+    the alerts are computed from averaged pixels, so small alerts can be lost
+    and a site with alerts can be reported without them. The finer the
+    scale, the fewer alerts are lost (and the higher the cost).
+
+    Is a server side code, so it returns a server side boolean (use `getInfo`
+    to retrieve it)
+    """
+    if not region:
+        region = alert.geometry()
+
+    image = class_image(alert, clas)
+    # the projection of a class band, the bands of the alert (area) may have
+    # other projections
+    projection = image.projection()
+
+    result = image.unmask().reduceRegion(**{
+        'reducer': ee.Reducer.max(),
+        'geometry': region,
+        'crs': projection.crs(),
+        'scale': scale,
+        'maxPixels': 1e13,
+        'bestEffort': True
+    })
+    value = ee.Algorithms.If(result.get('result'), result.get('result'), 0)
+    return ee.Number(value).gt(0)
+
+
+def histogram(alert, clas, region=None):
+    """ Return the number of pixels equal one in the given region """
+    if not region:
+        region = alert.geometry()
+
+    image = class_image(alert, clas)
 
     result = image.reduceRegion(**{
         'reducer': ee.Reducer.frequencyHistogram(),
         'geometry': region,
-        'scale': alert.projection().nominalScale(),
+        'scale': image.projection().nominalScale(),
         'maxPixels': 1e13
     })
 
@@ -181,8 +309,13 @@ def make_vector(image, region):
     return vector
 
 
-def make_alerts_vector(alerts, region):
-    """ accepts the result from alerts.period function """
+def make_alerts_vector(alerts, region, exactArea=False):
+    """ accepts the result from alerts.period function
+
+    :param exactArea: if True, `area_m2` is the area of the whole cluster the
+        polygon belongs to, taken from the `area` band (see alerts.period).
+        Otherwise it is the area of the polygon
+    """
     # band names
     year = ee.Number(alerts.get('year'))
     yearStr = year.format().slice(2,4)
@@ -198,11 +331,18 @@ def make_alerts_vector(alerts, region):
 
     # confirmed
     confmask = alerts.select([confB])
-    confirmed = alerts.updateMask(confmask).select([dateB, confB, probDB, confDB])
+    confbands = ee.List([dateB, confB, probDB, confDB])
 
     # probable
     probmask = alerts.select([probB])
-    probable = alerts.updateMask(probmask).select([dateB, probB, probDB, confDB])
+    probbands = ee.List([dateB, probB, probDB, confDB])
+
+    if exactArea:
+        confbands = confbands.add('area')
+        probbands = probbands.add('area')
+
+    confirmed = alerts.updateMask(confmask).select(confbands)
+    probable = alerts.updateMask(probmask).select(probbands)
 
     # make individual vectors
     vconf = make_vector(confirmed, region).map(
@@ -233,6 +373,8 @@ def make_alerts_vector(alerts, region):
         feat = feat.set(dateB, date)
         feat = feat.set(confDB, confBand)
         feat = feat.set(probDB, probBand)
+        if exactArea:
+            feat = feat.set('area_m2', feat.get('area'))
         props = ee.List(['class', dateB, confDB, probDB,
                          'start_period','end_period', 'area_m2'])
         return feat.select(props)
@@ -1,8 +1,10 @@
 # coding=utf-8
 import click
 from datetime import date as dt
+import hashlib
 import json
 import os
+import threading
 
 CONFIG = {
     'class': 'both',
@@ -12,8 +14,13 @@ CONFIG = {
     },
     'date': 'today',
     'minArea': 1000, # m2
+    'precheckScale': 0, # m
     'vectorMask': '',
     'rasterMask': '',
+    'deferMask': False,
+    'siteIndex': False,
+    'byRegion': False,
+    'exactArea': False,
     'drive': {
         'folder': 'gladAlerts',
         'format': 'GeoJSON'
@@ -24,11 +31,23 @@ CONFIG = {
     'local': {
         'folder': 'alerts',
         'subfolders': True,
-        'format': 'JSON'
+        'format': 'JSON',
+        'pageSize': 0,
+        'compression': None,
+        'postprocess': False
     },
-    'saveTo': 'local'
+    'saveTo': 'local',
+    'output': 'vector',
+    'cacheFolder': '',
+    'exportIndex': 'exported_alerts.sqlite',
+    'historyDB': 'history.sqlite',
+    'maskTilesFolder': 'masktiles'
 }
 
+# indexes of exported alerts by path (see open_index)
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
 HEADER = """Config file:
 
 {}
@@ -69,6 +88,176 @@ def initEE(logger=None):
             logger.log('Earth Engine initialized successfully')
 
 
+def parse_destinations(destination):
+    """ List of destinations from a comma separated string or a list """
+    if isinstance(destination, str):
+        destination = destination.split(',')
+    return [d.strip() for d in destination]
+
+
+def set_cache_folder(folder):
+    """ Keep the cached results, sites and graph templates in the given
+    folder """
+    from geepyGLAD import cache, sites, templates
+    cache.CACHE.folder = folder
+    sites.CACHE.folder = os.path.join(folder, 'sites')
+    templates.TEMPLATES.folder = os.path.join(folder, 'templates')
+
+
+def command_options(site=None, only_new=False, output=None):
+    """ Options of the run command shared by the commands that export alerts
+    """
+    options = ''
+    if site:
+        options += ' --site {}'.format(site)
+    if only_new:
+        options += ' --only-new'
+    if output:
+        options += ' -o {}'.format(output)
+    return options
+
+
+def start_log(config, command, name):
+    """ Make the logger of a run. Its name is `name` followed by the SHA-256
+    of the config and the command (the run ID) and its header holds both.
+    Returns (run ID, logger) """
+    config_str = json.dumps(config, indent=2)
+    tohash = '{} {}'.format(config_str, command).encode('utf-8')
+    hexcode = hashlib.sha256(tohash).hexdigest()
+
+    from geepyGLAD.logger import Logger
+    logger = Logger('{} {}'.format(name, hexcode), 'logs')
+    logger.header(HEADER.format(config_str, command))
+    return hexcode, logger
+
+
+def check_destinations(destination, logger=None):
+    """ True if all the given destinations are valid """
+    soptions = ['drive', 'asset', 'local']
+    if not all(d in soptions for d in destination):
+        msg = 'savein parameter must be one or many of {}'.format(soptions)
+        if logger:
+            logger.log(msg)
+        print(msg)
+        return False
+    return True
+
+
+def load_site(config, usersite=None):
+    """ The sites of the config (ee.FeatureCollection) or, if given, the site
+    with the name `usersite` (ee.Feature) """
+    import ee
+    property_name = config['site']['propertyName']
+    site = ee.FeatureCollection(config['site']['assetPath'])
+    if usersite:
+        site = site.filterMetadata(property_name, 'equals', usersite)
+        site = ee.Feature(site.first())
+    return site
+
+
+def site_cache(config):
+    """ The shared cache of preprocessed sites (sites.CACHE) for the sites of
+    the config: they are preprocessed again when the asset is updated """
+    from geepyGLAD import sites
+    version = sites.asset_version(config['site']['assetPath'])
+    return sites.CACHE.versioned(version)
+
+
+def open_index(path):
+    """ Index of exported alerts (dedup.Index) stored in the given path. The
+    jobs of a process (run-all) share one Index per path, so they do not
+    write the same database through different connections """
+    from geepyGLAD import dedup
+    key = os.path.abspath(path)
+    with _INDEXES_LOCK:
+        if key not in _INDEXES:
+            _INDEXES[key] = dedup.Index(path)
+        return _INDEXES[key]
+
+
+def batch_args(config, destination, mask=True, only_new=False, output=None):
+    """ Arguments of batch.period, batch.download and batch.backfill that are
+    taken from the config: folders, shared caches, output, local download
+    options, the index of exported alerts (only new) and the raster mask """
+    import ee
+    from geepyGLAD import templates
+
+    args = dict(
+        limit=config['minArea'],
+        property_name=config['site']['propertyName'],
+        folder={d: config[d]['folder'] for d in destination},
+        site_cache=site_cache(config),
+        template_cache=templates.TEMPLATES,
+        output=output or config.get('output', 'vector'),
+        precheck_scale=config.get('precheckScale') or None,
+        exact_area=bool(config.get('exactArea', False))
+    )
+
+    if 'local' in destination:
+        args['page_size'] = config['local'].get('pageSize')
+        args['compression'] = config['local'].get('compression')
+        args['postprocess'] = config['local'].get('postprocess', False)
+
+    if only_new:
+        index_path = config.get('exportIndex') or 'exported_alerts.sqlite'
+        args['dedup_index'] = open_index(index_path)
+
+    raster_mask_id = config['rasterMask']
+    if raster_mask_id and mask:
+        args['raster_mask'] = ee.Image(raster_mask_id)
+        args['defer_mask'] = bool(config.get('deferMask', False))
+
+    return args
+
+
+def start_history(config, command):
+    """ Record a new run in the history database of the config and return
+    its recorder """
+    from geepyGLAD import history
+    runs = history.History(config.get('historyDB') or 'history.sqlite')
+    config_str = json.dumps(config, indent=2)
+    config_hash = hashlib.sha256(config_str.encode('utf-8')).hexdigest()
+    return runs.start(command, config_hash)
+
+
+def log_stats(logger):
+    """ Log the counters of the caches and the requests """
+    from geepyGLAD import cache, governor, templates
+    logger.log('cache: {hits} hits, {misses} misses'.format(
+        **cache.stats()))
+    logger.log('graph templates: {hits} hits, {misses} misses'.format(
+        **templates.stats()))
+    logger.log('requests: {}'.format(governor.stats()))
+
+
+def print_plan(plans):
+    """ Print the result of batch.plan """
+    row = '{name:<30} {area:>12} {pixels:>14} {images:>6} {tiles:>8} ' \
+          '{tasks:>5} {downloads:>9} {requests:>8}  {warnings}'
+    print(row.format(name='site', area='area (ha)', pixels='pixels',
+                     images='images', tiles='tiles', tasks='tasks',
+                     downloads='downloads', requests='requests',
+                     warnings='warnings'))
+    total = dict(area=0, pixels=0, tiles=0, tasks=0, downloads=0, requests=0)
+    for p in plans:
+        for key in total:
+            total[key] += p[key]
+        print(row.format(name=str(p['name'])[:30],
+                         area='{:.1f}'.format(p['area'] / 10000),
+                         pixels=int(p['pixels']), images=p['images'],
+                         tiles=int(p['tiles']), tasks=p['tasks'],
+                         downloads=p['downloads'], requests=p['requests'],
+                         warnings=', '.join(p['warnings'])))
+    flagged = len([p for p in plans if p['warnings']])
+    print(row.format(name='TOTAL ({} sites, {} flagged)'.format(len(plans),
+                                                               flagged),
+                     area='{:.1f}'.format(total['area'] / 10000),
+                     pixels=int(total['pixels']), images='',
+                     tiles=int(total['tiles']), tasks=total['tasks'],
+                     downloads=total['downloads'],
+                     requests=total['requests'], warnings=''))
+
+
 @click.group()
 def main():
     pass
@@ -104,15 +293,28 @@ def update_config(parameter, value):
     - siteProperty: the name of the property that holds the name of the sites\n
     - date: date to process\n
     - minArea: minimum area in square meters\n
+    - precheckScale: scale (m) of a cheap, lossy check for alerts before the full resolution one (0 to disable)\n
     - vectorMask: the Asset path of the mask (ee.FeatureCollection) to apply\n
     - rasterMask: the Asset path of the mask (ee.Image) to apply\n
+    - deferMask: if True applies the raster mask to the results instead of to every image\n
+    - siteIndex: if True only the sites that intersect the GLAD images of the date are processed\n
+    - byRegion: if True compares the last two dates of each GLAD region of the sites\n
+    - exactArea: if True computes the exact area of big clusters of alerts (slower)\n
     - driveFolder: the folder name to upload the results to Google Drive\n
     - driveFormat: the format for the file to upload to Google Drive\n
     - assetFolder: the Asset path to upload the results\n
     - localFolder: the local folder to download the results\n
     - localFormat: the file format to download the results\n
     - localSub: if True creates subfolders for each site (given by siteProperty)\n
-    - saveTo: where to save results (drive, asset or local)\n
+    - localPageSize: number of features per request when downloading (0 to download all at once)\n
+    - localCompression: compression for the downloaded files (gzip, zstd or none)\n
+    - localPostprocess: if True dissolves and simplifies the downloaded alerts (needs shapely)\n
+    - saveTo: where to save results (drive, asset or local). Comma separated for many\n
+    - output: export the alerts as polygons (vector) or as a GeoTIFF (raster)\n
+    - cacheFolder: folder to keep computed results across runs (empty for no disk cache)\n
+    - exportIndex: file that holds the index of exported alerts (used with --only-new)\n
+    - historyDB: SQLite file that records the runs (see glad history)\n
+    - maskTilesFolder: folder of the local tiles of the raster mask (see glad mask-tiles)\n
     """
     endpoints = {
         'class': ['class'],
@@ -120,20 +322,43 @@ def update_config(parameter, value):
         'siteProperty': ['site', 'propertyName'],
         'date': ['date'],
         'minArea': ['minArea'],
+        'precheckScale': ['precheckScale'],
         'vectorMask': ['vectorMask'],
         'rasterMask': ['rasterMask'],
+        'deferMask': ['deferMask'],
+        'siteIndex': ['siteIndex'],
+        'byRegion': ['byRegion'],
+        'exactArea': ['exactArea'],
         'driveFolder': ['drive', 'folder'],
         'driveFormat': ['drive', 'format'],
         'assetFolder': ['asset', 'folder'],
         'localFolder': ['local', 'folder'],
         'localFormat': ['local', 'format'],
         'localSub': ['local', 'subfolders'],
-        'saveTo': ['saveTo']
+        'localPageSize': ['local', 'pageSize'],
+        'localCompression': ['local', 'compression'],
+        'localPostprocess': ['local', 'postprocess'],
+        'saveTo': ['saveTo'],
+        'output': ['output'],
+        'cacheFolder': ['cacheFolder'],
+        'exportIndex': ['exportIndex'],
+        'historyDB': ['historyDB'],
+        'maskTilesFolder': ['maskTilesFolder']
     }
 
-    if parameter in ['minArea']:
+    if parameter in ['minArea', 'localPageSize', 'precheckScale']:
         value = int(value)
 
+    if parameter in ['saveTo'] and ',' in value:
+        value = parse_destinations(value)
+
+    if parameter in ['deferMask', 'siteIndex', 'byRegion', 'exactArea',
+                     'localPostprocess']:
+        value = value.lower() in ['true', 'yes', '1']
+
+    if parameter in ['localCompression'] and value.lower() == 'none':
+        value = None
+
     fname = 'config.json'
     exists = os.path.isfile(fname)
     if not exists:
@@ -152,7 +377,7 @@ def update_config(parameter, value):
     if endpoint:
         upd = config
         for end in endpoint:
-            v = upd[end]
+            v = upd.get(end)
             if (not isinstance(v, dict)):
                 upd[end] = value
             else:
@@ -202,12 +427,18 @@ def sites():
 @click.argument('end')#, help='Start date for the period')
 @click.option('-y', '--year', default=None, help='Year of the alerts. If None will use the last image year')
 @click.option('-p', '--proxy', default=False, help='use proxy? If True start date will be dismissed')
-@click.option('-s', '--savein', default=None, help='where to save the files. Takes default from config.json')
+@click.option('-s', '--savein', default=None, help='where to save the files (comma separated for many). Takes default from config.json')
 @click.option('--site', default=None, help='The name of the site to process, must be present in the parsed property')
 @click.option('-m', '--mask', default=True, type=bool, help='Whether to use the mask in config file or not')
 @click.option('-v', '--verbose', default=True, type=bool)
 @click.option('--config', default=None, help='The name of the configuration file. Defaults to "config.json"')
-def period(start, end, year, proxy, savein, site, mask, verbose, config):
+@click.option('--plan', is_flag=True, default=False, help='Show an estimate of the work for each site and exit')
+@click.option('--only-new', is_flag=True, default=False, help='Export only alerts that are new or whose class changed since the last export')
+@click.option('--resume', is_flag=True, default=False, help='Resume a previous run of the same command, skipping the sites already done')
+@click.option('--retries', default=3, type=int, help='Number of times a failed site is retried')
+@click.option('-o', '--output', default=None, help='"vector" or "raster". Takes default from config.json')
+def period(start, end, year, proxy, savein, site, mask, verbose, config, plan,
+           only_new, resume, retries, output):
     """ Export a period (from START to END) of GLAD alerts to Google Drive,
     Earth Engine Asset or Local files. Takes configuration parameters from
     `config.json`.
@@ -220,102 +451,82 @@ def period(start, end, year, proxy, savein, site, mask, verbose, config):
     config = load_config(configname)
     if not config: return None
 
-    # SITE PARAMS
-    site_params = config['site']
-    asset_path = site_params['assetPath']
-    property_name = site_params['propertyName']
-    usersite = site  # change variable name
-
     # SAVE PARAMS
-    destination = savein or config['saveTo']
-    save_params = config[destination]
-    soptions = ['drive', 'asset', 'local']
-
-    # MIN AREA
-    limit = config['minArea']
+    destination = parse_destinations(savein or config['saveTo'])
 
-    # RUN COMMAND AND HASH
+    # RUN COMMAND AND LOGGER
     command = 'glad period {} {} --proxy {} -s {} -m {} -v {}'.format(
         start, end, proxy, savein, mask, verbose)
-    if usersite:
-        command += ' --site {}'.format(usersite)
-
-    config_str = json.dumps(config, indent=2)
-    tohash = '{} {}'.format(config_str, command)
-    tohash = tohash.encode('utf-8')
-    import hashlib
-    h = hashlib.sha256()
-    h.update(tohash)
-    hexcode = h.hexdigest()
-    logname = 'period {} to {} {}'.format(start, end, hexcode)
+    command += command_options(site, only_new, output)
+    hexcode, logger = start_log(config, command,
+                                'period {} to {}'.format(start, end))
 
-    header = HEADER.format(config_str, command)
-
-    # LOGGER
-    from geepyGLAD.logger import Logger
-    logdir = 'logs'
-    logger = Logger(logname, logdir)
-
-    logger.header(header)
-
-    if destination not in soptions:
-        msg = 'savein parameter must be one of {}'.format(soptions)
-        logger.log(msg)
-        print(msg)
+    if not check_destinations(destination, logger):
         return None
 
     # INITIALIZE EE
-    import ee
     initEE(logger)
     try:
-        from geepyGLAD import utils, alerts, batch
+        from geepyGLAD import batch, checkpoint
     except Exception as e:
         msg = 'ERROR while importing geepyGLAD - {}'.format(e)
         logger.log(msg)
         raise e
 
-    site = ee.FeatureCollection(asset_path)
+    cache_folder = config.get('cacheFolder')
+    if cache_folder:
+        set_cache_folder(cache_folder)
 
-    if usersite:
-        site = site.filterMetadata(property_name, 'equals', usersite)
-        site = ee.Feature(site.first())
+    collection = load_site(config, site)
 
-    args = dict(
+    if plan:
+        plans = batch.plan(collection, start, end, config['site']['propertyName'],
+                           destination)
+        print_plan(plans)
+        return None
+
+    args = batch_args(config, destination, mask, only_new, output)
+    args.update(
         start=start,
         end=end,
-        year=int(year),
+        year=int(year) if year else None,
         proxy=bool(proxy),
-        site=site,
-        limit=limit,
-        property_name=property_name,
+        site=collection,
         verbose=verbose,
-        folder=save_params['folder'],
-        logger=logger
+        logger=logger,
+        manifest=checkpoint.Manifest(hexcode, 'runs', resume),
+        retries=retries,
+        recorder=start_history(config, command)
     )
-
-    raster_mask_id = config['rasterMask']
-    if raster_mask_id and mask:
-        raster_mask = ee.Image(raster_mask_id)
-        args['raster_mask'] = raster_mask
+    status = 'failed'
 
     # COMPUTE ALERTS
     try:
         batch.period(**args, destination=destination)
+        status = 'done'
     except Exception as e:
         msg = 'ERROR: {}'.format(str(e))
         logger.log(msg)
         raise e
-
+    finally:
+        log_stats(logger)
+        args['recorder'].finish(status)
+        logger.log('sites: {}'.format(args['manifest'].summary()))
 
 @main.command()
-@click.option('-s', '--savein', default=None, help='where to save the files. Takes default from config.json')
+@click.option('-s', '--savein', default=None, help='where to save the files (comma separated for many). Takes default from config.json')
 @click.option('-c', '--clas', default=None, help='The class to export. Can be "probable", "confirmed" or "both"')
 @click.option('-d', '--date', default=None, help='If this param is not set, it will use the date for today')
 @click.option('--site', default=None, help='The name of the site to process, must be present in the parsed property')
 @click.option('-m', '--mask', default=True, type=bool, help='Whether to use the mask in config file or not')
 @click.option('-v', '--verbose', default=True, type=bool)
 @click.option('--config', default=None, help='The name of the configuration file. Defaults to "config.json"')
-def alert(savein, clas, date, site, mask, verbose, config):
+@click.option('--only-new', is_flag=True, default=False, help='Export only alerts that are new or whose class changed since the last export')
+@click.option('--resume', is_flag=True, default=False, help='Resume a previous run of the same command, skipping the sites already done')
+@click.option('--retries', default=3, type=int, help='Number of times a failed site is retried')
+@click.option('-o', '--output', default=None, help='"vector" or "raster". Takes default from config.json')
+def alert(savein, clas, date, site, mask, verbose, config, only_new, resume,
+          retries, output):
     """ Export GLAD alerts to Google Drive, Earth Engine Asset or Local files.
     Takes configuration parameters from `config.json`.
     """
@@ -327,106 +538,328 @@ def alert(savein, clas, date, site, mask, verbose, config):
     config = load_config(configname)
     if not config: return None
 
-    # SITE PARAMS
-    site_params = config['site']
-    asset_path = site_params['assetPath']
-    property_name = site_params['propertyName']
-    usersite = site  # change variable name
+    run_alert(config, savein, clas, date, site, mask, verbose, only_new,
+              resume, retries, output)
 
+
+def run_alert(config, savein=None, clas=None, date=None, site=None, mask=True,
+              verbose=True, only_new=False, resume=False, retries=3,
+              output=None, init=True):
+    """ Run the `alert` command with a loaded configuration. If `init` is
+    False, Earth Engine must be already initialized """
     # SAVE PARAMS
-    destination = savein or config['saveTo']
-    save_params = config[destination]
-    soptions = ['drive', 'asset', 'local']
+    destination = parse_destinations(savein or config['saveTo'])
 
     # DATE PARAMS
     if not date:
         date = config['date']
     alert_date = dt.today().isoformat() if date == 'today' else date
 
-    # MIN AREA
-    limit = config['minArea']
-
     # CLASS
     if not clas:
         clas = config['class']
 
-    # RUN COMMAND AND HASH
+    # RUN COMMAND AND LOGGER
+    # the resolved date, so runs of different days get different manifests
     command = 'glad alert -s {} -c {} -d {} -m {} -v {}'.format(
-        savein, clas, date, mask, verbose)
-    if usersite:
-        command += ' --site {}'.format(usersite)
-
-    config_str = json.dumps(config, indent=2)
-    tohash = '{} {}'.format(config_str, command)
-    tohash = tohash.encode('utf-8')
-    import hashlib
-    h = hashlib.sha256()
-    h.update(tohash)
-    hexcode = h.hexdigest()
-    logname = '{} {}'.format(date, hexcode)
-
-    header = HEADER.format(config_str, command)
-
-    # LOGGER
-    from geepyGLAD.logger import Logger
-    logdir = 'logs'
-    logger = Logger(logname, logdir)
-
-    logger.header(header)
+        savein, clas, alert_date, mask, verbose)
+    command += command_options(site, only_new, output)
+    hexcode, logger = start_log(config, command, date)
 
-    if destination not in soptions:
-        msg = 'savein parameter must be one of {}'.format(soptions)
-        logger.log(msg)
-        print(msg)
+    if not check_destinations(destination, logger):
         return None
 
     # INITIALIZE EE
-    import ee
-    initEE(logger)
+    if init:
+        initEE(logger)
     try:
-        from geepyGLAD import utils, alerts, batch
+        from geepyGLAD import utils, alerts, batch, cache, checkpoint
     except Exception as e:
         msg = 'ERROR while importing geepyGLAD - {}'.format(e)
         logger.log(msg)
         raise e
 
-    site = ee.FeatureCollection(asset_path)
+    # with many jobs (run-all) the caches are set once for all of them
+    cache_folder = config.get('cacheFolder')
+    if cache_folder and init:
+        set_cache_folder(cache_folder)
 
-    if usersite:
-        site = site.filterMetadata(property_name, 'equals', usersite)
-        site = ee.Feature(site.first())
+    collection = load_site(config, site)
 
     # Check for available alert image in the given date
-    has_images = utils.has_image(alert_date, alerts.ALERTS).getInfo()
+    has_images = cache.getInfo(utils.has_image(alert_date, alerts.ALERTS))
     if not has_images:
         msg = 'GLAD alerts not available for date {}'.format(date)
         logger.log(msg)
         print(msg)
         return None
 
-    args = dict(
-        site=site,
+    args = batch_args(config, destination, mask, only_new, output)
+    args.update(
+        site=collection,
         date=alert_date,
         clas=clas,
-        limit=limit,
-        property_name=property_name,
         verbose=verbose,
-        folder=save_params['folder'],
-        logger=logger
+        logger=logger,
+        manifest=checkpoint.Manifest(hexcode, 'runs', resume),
+        retries=retries,
+        recorder=start_history(config, command)
     )
+    status = 'failed'
 
-    raster_mask_id = config['rasterMask']
-    if raster_mask_id and mask:
-        raster_mask = ee.Image(raster_mask_id)
-        args['raster_mask'] = raster_mask
+    # COMPUTE ALERTS
+    try:
+        batch.download(**args, destination=destination,
+                       site_index=bool(config.get('siteIndex', False)),
+                       by_region=bool(config.get('byRegion', False)))
+        status = 'done'
+    except Exception as e:
+        msg = 'ERROR: {}'.format(str(e))
+        logger.log(msg)
+        raise e
+    finally:
+        log_stats(logger)
+        args['recorder'].finish(status)
+        logger.log('sites: {}'.format(args['manifest'].summary()))
+
+@main.command()
+@click.argument('start')
+@click.argument('end')
+@click.option('-s', '--savein', default=None, help='where to save the files (comma separated for many). Takes default from config.json')
+@click.option('-c', '--clas', default=None, help='The class to export. Can be "probable", "confirmed" or "both"')
+@click.option('--site', default=None, help='The name of the site to process, must be present in the parsed property')
+@click.option('-m', '--mask', default=True, type=bool, help='Whether to use the mask in config file or not')
+@click.option('-v', '--verbose', default=True, type=bool)
+@click.option('--config', default=None, help='The name of the configuration file. Defaults to "config.json"')
+@click.option('--only-new', is_flag=True, default=False, help='Export only alerts that are new or whose class changed since the last export')
+@click.option('--resume', is_flag=True, default=False, help='Resume a previous run of the same command, skipping the dates and sites already done')
+@click.option('--retries', default=3, type=int, help='Number of times a failed site is retried')
+@click.option('-o', '--output', default=None, help='"vector" or "raster". Takes default from config.json')
+@click.option('-w', '--workers', default=4, type=int, help='Number of dates processed at the same time')
+def backfill(start, end, savein, clas, site, mask, verbose, config, only_new,
+             resume, retries, output, workers):
+    """ Export the GLAD alerts of every date from START to END, as the
+    `alert` command does for one date. Dates are processed in parallel.
+    Takes configuration parameters from `config.json`.
+    """
+    # LOAD CONFIG FILE
+    configname = config  # change variable name
+    if not configname:
+        configname = 'config.json'
+
+    config = load_config(configname)
+    if not config: return None
+
+    # SAVE PARAMS
+    destination = parse_destinations(savein or config['saveTo'])
+
+    # CLASS
+    if not clas:
+        clas = config['class']
+
+    # RUN COMMAND AND LOGGER
+    command = 'glad backfill {} {} -s {} -c {} -m {} -v {}'.format(
+        start, end, savein, clas, mask, verbose)
+    command += command_options(site, only_new, output)
+    hexcode, logger = start_log(config, command,
+                                'backfill {} to {}'.format(start, end))
+
+    if not check_destinations(destination, logger):
+        return None
+
+    # INITIALIZE EE
+    initEE(logger)
+    try:
+        from geepyGLAD import batch
+    except Exception as e:
+        msg = 'ERROR while importing geepyGLAD - {}'.format(e)
+        logger.log(msg)
+        raise e
+
+    cache_folder = config.get('cacheFolder')
+    if cache_folder:
+        set_cache_folder(cache_folder)
+
+    args = batch_args(config, destination, mask, only_new, output)
+    args.update(
+        site=load_site(config, site),
+        start=start,
+        end=end,
+        clas=clas,
+        verbose=verbose,
+        logger=logger,
+        run_id=hexcode,
+        resume=resume,
+        retries=retries,
+        workers=workers,
+        recorder=start_history(config, command)
+    )
+    status = 'failed'
 
     # COMPUTE ALERTS
+    results = {}
     try:
-        batch.download(**args, destination=destination)
+        results = batch.backfill(**args, destination=destination,
+                                 site_index=bool(config.get('siteIndex',
+                                                            False)),
+                                 by_region=bool(config.get('byRegion',
+                                                           False)))
+        status = 'done'
     except Exception as e:
         msg = 'ERROR: {}'.format(str(e))
         logger.log(msg)
         raise e
+    finally:
+        log_stats(logger)
+        args['recorder'].finish(status)
+        for date in sorted(results):
+            logger.log('{}: {}'.format(date, results[date]))
+
+@main.command()
+@click.argument('query', type=click.Choice(['slowest', 'stages', 'growth', 'windows']))
+@click.option('-n', '--limit', default=10, type=int, help='Number of sites to show (slowest)')
+@click.option('-p', '--percentile', default=95, type=float, help='Percentile of the stage durations (stages)')
+@click.option('--config', default=None, help='The name of the configuration file. Defaults to "config.json"')
+def history(query, limit, percentile, config):
+    """ Query the history of runs: the slowest sites, a percentile of the
+    duration of each stage, the growth of alerts per day or the figures of
+    every date of the backfill runs (windows).
+    """
+    configname = config or 'config.json'
+    config = load_config(configname)
+    if not config: return None
+
+    path = config.get('historyDB') or 'history.sqlite'
+    if not os.path.isfile(path):
+        print('There is no history yet ({} not found)'.format(path))
+        return None
+
+    from geepyGLAD.history import History
+    runs = History(path)
+
+    if query == 'slowest':
+        row = '{:<30} {:>12} {:>6}'
+        print(row.format('site', 'mean (s)', 'runs'))
+        for site, seconds, count in runs.slowest_sites(limit):
+            print(row.format(site[:30], '{:.1f}'.format(seconds), count))
+    elif query == 'stages':
+        row = '{:<10} {:>12} {:>8}'
+        print(row.format('stage', 'p{:g} (s)'.format(percentile), 'records'))
+        for stage, seconds, count in runs.stage_percentiles(percentile):
+            print(row.format(stage, '{:.1f}'.format(seconds), count))
+    elif query == 'windows':
+        row = '{:>5} {:<10} {:>14} {:>14} {:>6} {:>6} {:>10}'
+        print(row.format('run', 'date', 'alert pixels', 'bytes', 'sites',
+                         'errors', 'time (s)'))
+        for run, date, alerts, nbytes, count, errors, seconds in \
+                runs.windows():
+            print(row.format(run, date, alerts or 0, nbytes or 0, count,
+                             errors, '{:.1f}'.format(seconds or 0)))
+    else:
+        row = '{:<10} {:>14} {:>14} {:>6}'
+        print(row.format('day', 'alert pixels', 'bytes', 'runs'))
+        for day, alerts, nbytes, count in runs.alert_growth():
+            print(row.format(day, alerts or 0, nbytes or 0, count))
+    runs.close()
+
+
+@main.command()
+@click.argument('configs', nargs=-1, required=True)
+@click.option('-d', '--date', default=None, help='Date for all the jobs. If not set, it will use the date of each configuration file')
+@click.option('-m', '--mask', default=True, type=bool, help='Whether to use the mask in config files or not')
+@click.option('-v', '--verbose', default=True, type=bool)
+@click.option('--only-new', is_flag=True, default=False, help='Export only alerts that are new or whose class changed since the last export')
+@click.option('--resume', is_flag=True, default=False, help='Resume previous runs of the same jobs, skipping the sites already done')
+@click.option('--retries', default=3, type=int, help='Number of times a failed site is retried')
+@click.option('-w', '--workers', default=4, type=int, help='Number of jobs processed at the same time')
+def run_all(configs, date, mask, verbose, only_new, resume, retries,
+            workers):
+    """ Run the `alert` command for many configuration files (CONFIGS) in a
+    single process. Earth Engine is initialized once, identical jobs are run
+    once, and the jobs share the caches of results, sites and graphs.
+    """
+    jobs = {}
+    for configname in configs:
+        config = load_config(configname)
+        if not config: return None
+        key = json.dumps([config, date], sort_keys=True)
+        if key in jobs:
+            print('{} is the same job as {}, skipping'.format(
+                configname, jobs[key][0]))
+            continue
+        jobs[key] = (configname, config)
+
+    initEE()
+
+    # shared caches
+    folders = [c.get('cacheFolder') for _, c in jobs.values()]
+    folders = [f for f in folders if f]
+    if len(set(folders)) > 1:
+        print('WARNING: the configuration files have different cacheFolder '
+              'values ({}), all the jobs will use "{}"'.format(
+                  ', '.join(sorted(set(folders))), folders[0]))
+    if folders:
+        set_cache_folder(folders[0])
+
+    def job(configname, config):
+        try:
+            run_alert(config, date=date, mask=mask, verbose=verbose,
+                      only_new=only_new, resume=resume, retries=retries,
+                      init=False)
+        except Exception as e:
+            print('{}: ERROR - {}'.format(configname, e))
+            return False
+        return True
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [(name, executor.submit(job, name, config))
+                   for name, config in jobs.values()]
+        failed = [name for name, future in futures if not future.result()]
+
+    print('{} jobs run, {} failed'.format(len(futures), len(failed)))
+    for name in failed:
+        print('  FAILED: {}'.format(name))
+
+
+@main.command()
+@click.option('--site', default=None, help='The name of the site to process, must be present in the parsed property')
+@click.option('--config', default=None, help='The name of the configuration file. Defaults to "config.json"')
+def mask_tiles(site, config):
+    """ Fetch the raster mask (rasterMask) of the sites once and store it
+    locally on the GLAD grid, bit-packed (1 bit per pixel). Tiles already
+    stored are not fetched again.
+    """
+    configname = config or 'config.json'
+    config = load_config(configname)
+    if not config: return None
+
+    mask_id = config.get('rasterMask')
+    if not mask_id:
+        print('There is no rasterMask in {}'.format(configname))
+        return None
+
+    property_name = config['site']['propertyName']
+
+    initEE()
+    import ee
+    from geepyGLAD import batch, sites, masktiles
+
+    cache_folder = config.get('cacheFolder')
+    if cache_folder:
+        set_cache_folder(cache_folder)
+
+    collection = load_site(config, site)
+
+    tiles = masktiles.TileCache(
+        mask_id, config.get('maskTilesFolder') or 'masktiles')
+    image = ee.Image(mask_id)
+    site_info = site_cache(config)
+    for name, geom in batch._list_sites(collection, property_name,
+                                        site_info):
+        bbox = sites.bbox_of(site_info.info(geom)['bbox'])
+        fetched = tiles.ensure(bbox, image)
+        print('{}: {} tiles fetched'.format(name or 'N/A', fetched))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,208 @@
+# coding=utf-8
+
+""" Test configuration. There is no Earth Engine server in the tests: objects
+are evaluated by a fake getInfo server (see FakeServer). If the earthengine
+API or geetools are not installed, fake modules with the few names the
+package uses are installed instead """
+
+import json
+import os
+import sys
+import types
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+class FakeServer(object):
+    """ Answers the getInfo requests of FakeObject by name. A value can be a
+    function (called on every request) or an exception (raised). Every
+    request is recorded in `requests` """
+    def __init__(self):
+        self.values = {}
+        self.requests = []
+
+    def answer(self, name):
+        self.requests.append(name)
+        value = self.values[name]
+        if isinstance(value, Exception):
+            raise value
+        if callable(value):
+            return value()
+        return value
+
+
+class FakeObject(object):
+    """ Server side object evaluated by a FakeServer """
+    def __init__(self, server, name):
+        self.server = server
+        self.name = name
+
+    def getInfo(self):
+        return self.server.answer(self.name)
+
+
+class FakeCombined(object):
+    """ ee.Dictionary or ee.List of FakeObject, evaluated in one request """
+    def __init__(self, server, objects):
+        self.server = server
+        self.objects = objects
+        self.name = 'combined'
+
+    def getInfo(self):
+        self.server.requests.append(self.name)
+        if isinstance(self.objects, dict):
+            return {key: self.server.values[obj.name]
+                    for key, obj in self.objects.items()}
+        return [self.server.values[obj.name] for obj in self.objects]
+
+
+class FakeResponse(object):
+    """ Streamed response of FakeRequests """
+    def __init__(self, requests, status, content=b''):
+        self.requests = requests
+        self.status_code = status
+        self.content = content
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise self.requests.HTTPError(
+                '{} Error'.format(self.status_code), response=self)
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeRequests(types.ModuleType):
+    """ requests module whose GET requests are answered with the statuses
+    in `statuses` (the last one is repeated). Every response is recorded in
+    `responses` """
+    class HTTPError(Exception):
+        def __init__(self, msg, response=None):
+            super(FakeRequests.HTTPError, self).__init__(msg)
+            self.response = response
+
+    def __init__(self, statuses, content=b''):
+        super(FakeRequests, self).__init__('requests')
+        self.statuses = list(statuses)
+        self.content = content
+        self.responses = []
+
+    def get(self, url, stream=False):
+        status = self.statuses.pop(0) if len(self.statuses) > 1 \
+            else self.statuses[0]
+        response = FakeResponse(self, status, self.content)
+        self.responses.append(response)
+        return response
+
+
+def _fake_ee():
+    ee = types.ModuleType('ee')
+
+    class EEException(Exception):
+        pass
+
+    class ComputedObject(object):
+        def __init__(self, *args, **kwargs):
+            self.args = args
+
+    class Feature(ComputedObject):
+        pass
+
+    class FeatureCollection(ComputedObject):
+        pass
+
+    class Image(ComputedObject):
+        pass
+
+    class ImageCollection(ComputedObject):
+        pass
+
+    def toJSON(obj):
+        return json.dumps(getattr(obj, 'name', repr(obj)))
+
+    ee.EEException = EEException
+    ee.ComputedObject = ComputedObject
+    ee.Feature = Feature
+    ee.FeatureCollection = FeatureCollection
+    ee.Image = Image
+    ee.ImageCollection = ImageCollection
+    ee.Initialize = lambda *args, **kwargs: None
+    ee.serializer = types.SimpleNamespace(toJSON=toJSON)
+    ee.deserializer = types.SimpleNamespace(fromJSON=json.loads)
+    ee.data = types.SimpleNamespace()
+    ee.batch = types.SimpleNamespace()
+    return ee
+
+
+def _fake_geetools():
+    geetools = types.ModuleType('geetools')
+    geetools.tools = types.ModuleType('geetools.tools')
+    geetools.batch = types.ModuleType('geetools.batch')
+    return geetools
+
+
+try:
+    import ee
+except ImportError:
+    sys.modules['ee'] = _fake_ee()
+
+try:
+    import geetools
+except ImportError:
+    geetools = _fake_geetools()
+    sys.modules['geetools'] = geetools
+    sys.modules['geetools.tools'] = geetools.tools
+    sys.modules['geetools.batch'] = geetools.batch
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """ A FakeServer. Graphs of FakeObject are serialized by name, so equal
+    names are the same computation (see cache.graph_key). ee.Dictionary and
+    ee.List of FakeObject are evaluated in one request named 'combined' """
+    import ee
+    fake = FakeServer()
+    monkeypatch.setattr(ee.serializer, 'toJSON',
+                        lambda obj: json.dumps(obj.name))
+    monkeypatch.setattr(ee, 'Dictionary',
+                        lambda objects: FakeCombined(fake, objects),
+                        raising=False)
+    monkeypatch.setattr(ee, 'List',
+                        lambda objects: FakeCombined(fake, objects),
+                        raising=False)
+    return fake
+
+
+@pytest.fixture
+def obj(server):
+    """ Factory of FakeObject evaluated by the `server` fixture """
+    def make(name, value=None):
+        if value is not None:
+            server.values[name] = value
+        return FakeObject(server, name)
+    return make
+
+
+@pytest.fixture
+def fake_requests(monkeypatch):
+    """ Factory that installs a FakeRequests as the requests module """
+    def make(statuses, content=b''):
+        fake = FakeRequests(statuses, content)
+        monkeypatch.setitem(sys.modules, 'requests', fake)
+        return fake
+    return make
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    """ Retries do not wait """
+    import time
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
@@ -0,0 +1,49 @@
+# coding=utf-8
+
+import asyncio
+import threading
+import time
+from geepyGLAD import aio, sites
+
+
+def test_gather(server, obj):
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def answer(value):
+        def evaluate():
+            with lock:
+                active.append(value)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.remove(value)
+            return value
+        return evaluate
+    objects = [obj('v{}'.format(i), answer(i)) for i in range(8)]
+    assert asyncio.run(aio.gather(objects, concurrency=3)) == list(range(8))
+    assert 1 < max(peak) <= 3
+
+
+def test_combine(server, obj):
+    objects = {'a': obj('a', 1), 'b': obj('b', 2)}
+    assert aio.combine(objects) == {'a': 1, 'b': 2}
+    assert aio.evaluate([obj('a'), obj('b')], combined=True) == [1, 2]
+    assert server.requests == ['combined', 'combined']
+
+
+def test_prefetch_sites(server, obj, monkeypatch):
+    monkeypatch.setattr(sites, 'describe',
+                        lambda geometry, maxError: obj(geometry.name))
+    geometries = [obj('site{}'.format(i), {'bbox': i}) for i in range(5)]
+    cache = sites.SiteCache()
+    cache.info(geometries[0])
+    assert server.requests == ['site0']
+
+    # the other 4 sites in 2 combined requests
+    assert cache.prefetch(geometries, size=2) == 4
+    assert server.requests == ['site0', 'combined', 'combined']
+    assert [cache.info(g)['bbox'] for g in geometries] == list(range(5))
+    assert cache.prefetch(geometries) == 0
+    assert len(server.requests) == 3
@@ -0,0 +1,117 @@
+# coding=utf-8
+
+import asyncio
+import threading
+import time
+import pytest
+from geepyGLAD import batch, checkpoint
+
+SITES = [('site{}'.format(i), 'geometry{}'.format(i)) for i in range(6)]
+
+
+class Tracker(object):
+    """ Fake site processing that records the sites and the maximum number
+    of sites processed at the same time """
+    def __init__(self, fail=()):
+        self.fail = fail
+        self.sites = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def process(self, name):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.05)
+        with self._lock:
+            self.active -= 1
+            self.sites.append(name)
+        if name in self.fail:
+            raise RuntimeError('{} failed'.format(name))
+        return ['{}.geojson'.format(name)]
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    tracker = Tracker()
+    monkeypatch.setattr(batch, '_iter_sites',
+                        lambda site, property_name=None: iter(SITES))
+    monkeypatch.setattr(batch, '_site_args',
+                        lambda geometry, site_cache=None, by_region=False: {})
+
+    def process_period(start, end, geom, limit, year, eightConnected, proxy,
+                       raster_mask, destination, name, folder, **kwargs):
+        return tracker.process(name)
+
+    def process(geom, date, clas, limit, folder, raster_mask, destination,
+                filename, name, **kwargs):
+        assert filename == 'alerts_for_{}_{}'.format(date, name)
+        return tracker.process(name)
+
+    monkeypatch.setattr(batch, '_process_period', process_period)
+    monkeypatch.setattr(batch, '_process', process)
+    return tracker
+
+
+def test_period_sequential(tracker, tmpdir):
+    manifest = checkpoint.Manifest('run', str(tmpdir))
+    batch.period('sites', '2020-01-01', '2020-02-01', 500, verbose=False,
+                 manifest=manifest)
+    assert tracker.sites == [name for name, _ in SITES]
+    assert tracker.max_active == 1
+    assert manifest.summary() == {checkpoint.DONE: len(SITES)}
+
+
+def test_period_async(tracker, tmpdir):
+    manifest = checkpoint.Manifest('run', str(tmpdir))
+    asyncio.run(batch.period_async('sites', '2020-01-01', '2020-02-01', 500,
+                                   verbose=False, manifest=manifest,
+                                   concurrency=3))
+    assert sorted(tracker.sites) == sorted(name for name, _ in SITES)
+    assert 1 < tracker.max_active <= 3
+    assert manifest.summary() == {checkpoint.DONE: len(SITES)}
+
+
+def test_download_async(tracker, tmpdir):
+    tracker.fail = ['site2']
+    manifest = checkpoint.Manifest('run', str(tmpdir))
+    asyncio.run(batch.download_async('sites', '2020-01-01', 'both', 500,
+                                     verbose=False, manifest=manifest,
+                                     check_image=False, concurrency=2))
+    assert 1 < tracker.max_active <= 2
+    assert manifest.summary() == {checkpoint.DONE: len(SITES) - 1,
+                                  checkpoint.FAILED: 1}
+    assert manifest.status('site2') == checkpoint.FAILED
+
+
+def test_errors_without_manifest(tracker):
+    tracker.fail = ['site0']
+    with pytest.raises(RuntimeError):
+        batch.download('sites', '2020-01-01', 'both', 500, verbose=False,
+                       check_image=False, workers=2)
+    # the other sites are processed
+    assert len(tracker.sites) == len(SITES)
+
+
+
+def test_inline():
+    features = [{'type': 'Feature', 'properties': {'id': i}, 'geometry': None}
+                for i in range(10)]
+    assert batch._inline(features, max_bytes=10) is None
+    assert batch._inline(features, max_bytes=10000) is not None
+
+
+def test_download_file(fake_requests, tmpdir, no_sleep):
+    requests = fake_requests([500, 200], b'raster data')
+    batch.downloadFile('url', 'raster', 'tif', str(tmpdir))
+    assert tmpdir.join('raster.tif').read_binary() == b'raster data'
+    assert len(requests.responses) == 2
+    assert requests.responses[-1].closed
+
+
+def test_download_file_fails(fake_requests, tmpdir, no_sleep):
+    requests = fake_requests([404])
+    with pytest.raises(requests.HTTPError):
+        batch.downloadFile('url', 'raster', 'tif', str(tmpdir))
+    assert not tmpdir.join('raster.tif').check()
@@ -0,0 +1,27 @@
+# coding=utf-8
+
+from geepyGLAD import cache
+
+
+def test_same_graph_is_evaluated_once(server, obj):
+    results = cache.Cache(version='v1')
+    assert results.getInfo(obj('count', 3)) == 3
+    assert results.getInfo(obj('count')) == 3
+    assert server.requests == ['count']
+    assert results.stats() == dict(hits=1, misses=1)
+
+
+def test_new_version_invalidates(server, obj):
+    results = cache.Cache(version='v1')
+    results.getInfo(obj('count', 3))
+    results._version = 'v2'
+    results.getInfo(obj('count'))
+    assert server.requests == ['count', 'count']
+
+
+def test_folder(server, obj, tmpdir):
+    folder = str(tmpdir.join('cache'))
+    cache.Cache(folder, version='v1').getInfo(obj('count', 3))
+    # a new cache (a new run) reads the result from disk
+    assert cache.Cache(folder, version='v1').getInfo(obj('count')) == 3
+    assert server.requests == ['count']
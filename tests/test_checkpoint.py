@@ -0,0 +1,84 @@
+# coding=utf-8
+
+import pytest
+from geepyGLAD import batch, checkpoint
+
+
+def test_resume(tmpdir):
+    folder = str(tmpdir)
+    manifest = checkpoint.Manifest('run', folder)
+    assert checkpoint.run(lambda: ['a.geojson'], 'site', manifest) == \
+        ['a.geojson']
+    assert manifest.done('site')
+
+    resumed = checkpoint.Manifest('run', folder, resume=True)
+    calls = []
+    assert checkpoint.run(lambda: calls.append(1), 'site', resumed) is None
+    assert calls == []
+
+    # without resume the manifest starts again
+    assert checkpoint.Manifest('run', folder, resume=False).status('site') \
+        is None
+
+
+def test_retries_then_fail(tmpdir, no_sleep):
+    manifest = checkpoint.Manifest('run', str(tmpdir))
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise RuntimeError('boom')
+    assert checkpoint.run(fail, 'site', manifest, retries=2) is None
+    assert len(calls) == 3
+    assert manifest.status('site') == checkpoint.FAILED
+    assert manifest.summary() == {checkpoint.FAILED: 1}
+
+
+def test_without_manifest_raises(no_sleep):
+    def fail():
+        raise RuntimeError('boom')
+    with pytest.raises(RuntimeError):
+        checkpoint.run(fail, 'site')
+
+
+def test_retry_only_failed_destinations(tmpdir, no_sleep):
+    manifest = checkpoint.Manifest('run', str(tmpdir))
+    calls = []
+
+    def export(destinations):
+        calls.append(list(destinations))
+        # drive fails the first time
+        return [None if d == 'drive' and len(calls) == 1 else d + ':file'
+                for d in destinations]
+    outputs = batch._checkpointed(export, 'site', ['local', 'drive', 'asset'],
+                                  manifest, retries=1, verbose=False)
+    assert calls == [['local', 'drive', 'asset'], ['drive']]
+    assert outputs == ['local:file', 'drive:file', 'asset:file']
+    assert manifest.done('site')
+
+
+def test_resume_only_failed_destinations(tmpdir, no_sleep):
+    folder = str(tmpdir)
+    manifest = checkpoint.Manifest('run', folder)
+    batch._checkpointed(lambda destinations: ['local:file', None], 'site',
+                        ['local', 'drive'], manifest, verbose=False)
+    assert manifest.status('site') == checkpoint.FAILED
+    assert manifest.outputs('site') == {'local': 'local:file'}
+
+    calls = []
+
+    def export(destinations):
+        calls.append(destinations)
+        return ['drive:file']
+    resumed = checkpoint.Manifest('run', folder, resume=True)
+    batch._checkpointed(export, 'site', ['local', 'drive'], resumed,
+                        verbose=False)
+    assert calls == [['drive']]
+    assert resumed.done('site')
+
+
+def test_no_alerts(tmpdir):
+    manifest = checkpoint.Manifest('run', str(tmpdir))
+    assert batch._checkpointed(lambda destinations: [], 'site', 'local',
+                               manifest, verbose=False) == []
+    assert manifest.done('site')
@@ -0,0 +1,66 @@
+# coding=utf-8
+
+import json
+import threading
+from geepyGLAD import dedup
+
+
+def alert(i, clas='probable'):
+    x = float(i)
+    return {'type': 'Feature',
+            'properties': {'class': clas,
+                           'alertDate20': '2020-01-0{}'.format(i)},
+            'geometry': {'type': 'Polygon',
+                         'coordinates': [[[x, 0.], [x + 1, 0.], [x, 1.],
+                                          [x, 0.]]]}}
+
+
+def test_new_alerts(tmpdir):
+    path = str(tmpdir.join('index.sqlite'))
+    index = dedup.Index(path)
+    features = [alert(1), alert(2)]
+    assert index.new('site', features) == features
+    index.add('site', features)
+    index.save()
+
+    # other site, new alert and changed class
+    assert index.new('other', features) == features
+    changed = alert(2, 'confirmed')
+    assert index.new('site', [alert(1), changed, alert(3)]) == \
+        [changed, alert(3)]
+    index.close()
+
+    # saved to disk
+    assert dedup.Index(path).new('site', features) == []
+
+
+def test_geometry_hash_rounding():
+    a = alert(1)
+    b = alert(1)
+    b['geometry']['coordinates'][0][0][0] += 1e-9
+    assert dedup.feature_key(a) == dedup.feature_key(b)
+
+
+def test_import_legacy_json(tmpdir):
+    legacy = tmpdir.join('exported_alerts.json')
+    key = dedup.feature_key(alert(1))
+    legacy.write(json.dumps({'site': {key: 'probable'}}))
+    index = dedup.Index(str(legacy))
+    assert index.path == str(tmpdir.join('exported_alerts.sqlite'))
+    assert index.new('site', [alert(1), alert(2)]) == [alert(2)]
+
+
+def test_new_does_not_block_while_streaming(tmpdir):
+    index = dedup.Index(str(tmpdir.join('index.sqlite')))
+    other = []
+
+    def slow_stream():
+        # another site is checked while this stream is being read
+        yield alert(1)
+        thread = threading.Thread(
+            target=lambda: other.append(index.new('other', [alert(2)])))
+        thread.start()
+        thread.join(5)
+        yield alert(3)
+    assert index.new('site', slow_stream()) == [alert(1), alert(3)]
+    assert other == [[alert(2)]]
@@ -0,0 +1,105 @@
+# coding=utf-8
+
+import pytest
+from geepyGLAD import governor
+
+
+class HttpError(Exception):
+    """ Error with the status in `resp.status` (as googleapiclient) """
+    def __init__(self, status):
+        super(HttpError, self).__init__('<HttpError {}>'.format(status))
+        self.resp = type('Response', (object,), {'status': status})()
+
+
+@pytest.mark.parametrize('message', [
+    'Too many concurrent aggregations.',
+    'Quota exceeded for this project.',
+    '<HttpError 429 when requesting https://earthengine.googleapis.com>',
+])
+def test_throttling(message):
+    error = Exception(message)
+    assert governor.is_throttling(error)
+    assert governor.is_retryable(error)
+
+
+@pytest.mark.parametrize('message', [
+    'Computation timed out.',
+    '<HttpError 503 when requesting https://earthengine.googleapis.com>',
+    'Request failed with status 500',
+])
+def test_transient(message):
+    error = Exception(message)
+    assert not governor.is_throttling(error)
+    assert governor.is_retryable(error)
+
+
+@pytest.mark.parametrize('message', [
+    'Collection query aborted after accumulating over 5000 elements.',
+    'User memory limit exceeded.',
+    'Image.select: Pattern \'probable500\' did not match any bands.',
+    'Asset projects/x/5029 not found.',
+])
+def test_not_retryable(message):
+    error = Exception(message)
+    assert not governor.is_throttling(error)
+    assert not governor.is_retryable(error)
+
+
+def test_status_of_attribute():
+    assert governor.status_of(HttpError(429)) == 429
+    assert governor.is_throttling(HttpError(429))
+    assert governor.is_retryable(HttpError(502))
+    assert not governor.is_retryable(HttpError(400))
+
+
+def test_call_retries(server, obj, no_sleep):
+    answers = [Exception('Too many concurrent aggregations.'),
+               Exception('Computation timed out.')]
+
+    def answer():
+        if answers:
+            raise answers.pop(0)
+        return 42
+    gov = governor.Governor(concurrency=2, retries=3)
+    assert gov.getInfo(obj('value', answer)) == 42
+    stats = gov.stats()
+    assert stats['requests'] == 3
+    assert stats['retried'] == 2
+    assert stats['throttled'] == 1
+    assert stats['succeeded'] == 1
+    # 2, halved by the throttling, then + 1 / limit for the other requests
+    assert stats['concurrency'] == 2
+
+
+def test_call_fails(server, obj, no_sleep):
+    gov = governor.Governor(retries=2)
+    server.values['value'] = Exception('Computation timed out.')
+    with pytest.raises(Exception):
+        gov.getInfo(obj('value'))
+    assert len(server.requests) == 3
+    assert gov.stats()['failed'] == 1
+
+
+def test_call_does_not_retry_other_errors(server, obj, no_sleep):
+    gov = governor.Governor(retries=2)
+    server.values['value'] = Exception('over 5000 elements')
+    with pytest.raises(Exception):
+        gov.getInfo(obj('value'))
+    assert len(server.requests) == 1
+
+
+def test_submit_retries_throttling_only(no_sleep):
+    calls = []
+
+    def start(error):
+        calls.append(error)
+        if len(calls) == 1:
+            raise error
+    gov = governor.Governor(retries=3)
+    gov.submit(start, HttpError(429))
+    assert len(calls) == 2
+
+    calls[:] = []
+    with pytest.raises(Exception):
+        gov.submit(start, Exception('Computation timed out.'))
+    assert len(calls) == 1
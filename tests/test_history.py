@@ -0,0 +1,79 @@
+# coding=utf-8
+
+from geepyGLAD import history
+
+
+def test_percentile():
+    assert history.percentile([], 95) is None
+    assert history.percentile([3, 1, 2], 50) == 2
+    assert history.percentile(range(1, 101), 95) == 95
+
+
+def test_run(tmpdir):
+    runs = history.History(str(tmpdir.join('history.sqlite')))
+    run = runs.start('glad alert', 'hash')
+    with run.stage('a', 'build'):
+        pass
+    with run.stage('b', 'build'):
+        pass
+    run.alerts('a', 10)
+    run.written('a', 100)
+    run.written('a', 50)
+    run.error('b', RuntimeError('boom'))
+    run.finish()
+
+    assert sorted(s for s, _, _ in runs.slowest_sites()) == ['a', 'b']
+    stage, _, count = runs.stage_percentiles()[0]
+    assert (stage, count) == ('build', 2)
+    _, alerts, nbytes, count = runs.alert_growth()[0]
+    assert (alerts, nbytes, count) == (10, 150, 1)
+    assert runs.execute('SELECT error FROM sites WHERE site = ?',
+                        ('b',)) == [('boom',)]
+    assert runs.execute('SELECT status FROM runs') == [('done',)]
+    runs.close()
+
+
+def test_windows(tmpdir):
+    runs = history.History(str(tmpdir.join('history.sqlite')))
+    run = runs.start('glad backfill')
+    for date, count in [('2020-01-01', 10), ('2020-01-02', 20)]:
+        window = run.window(date)
+        with window.stage('a', 'build'):
+            pass
+        window.alerts('a', count)
+        window.written('a', count * 10)
+    run.window('2020-01-02').error('b', RuntimeError('boom'))
+    run.finish()
+
+    rows = runs.windows()
+    assert [row[:6] for row in rows] == [
+        (run.id, '2020-01-01', 10, 100, 1, 0),
+        (run.id, '2020-01-02', 20, 200, 2, 1)]
+    _, alerts, nbytes, _ = runs.alert_growth()[0]
+    assert (alerts, nbytes) == (30, 300)
+    # the mean of the site is taken per date
+    assert runs.slowest_sites()[0][2] == 2
+    runs.close()
+
+
+def test_migrate(tmpdir):
+    import sqlite3
+    path = str(tmpdir.join('history.sqlite'))
+    db = sqlite3.connect(path)
+    db.executescript("""
+        CREATE TABLE stages (run INTEGER, site TEXT, stage TEXT,
+                             seconds REAL);
+        CREATE TABLE sites (run INTEGER, site TEXT, alerts INTEGER,
+                            bytes INTEGER DEFAULT 0, error TEXT,
+                            PRIMARY KEY (run, site));
+        INSERT INTO sites (run, site, alerts) VALUES (1, 'a', 5);
+    """)
+    db.close()
+    runs = history.History(path)
+    assert runs.execute('SELECT site, date, alerts FROM sites') == \
+        [('a', '', 5)]
+    run = runs.start('glad backfill')
+    run.window('2020-01-01').alerts('a', 1)
+    run.window('2020-01-02').alerts('a', 2)
+    assert len(runs.windows(run.id)) == 2
+    runs.close()
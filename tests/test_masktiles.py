@@ -0,0 +1,95 @@
+# coding=utf-8
+
+import pytest
+from geepyGLAD import masktiles
+
+# small tiles: 16 pixels of 1 degree
+SCALE = 1.
+SIZE = 16
+
+
+def test_tile_of():
+    assert masktiles.tile_of(-180, 90) == (0, 0, 0, 0)
+    assert masktiles.tile_of(-179.99990, 89.99990) == (0, 0, 0, 0)
+    assert masktiles.tile_of(-179.00010, 89.00010) == (0, 0, 3999, 3999)
+    assert masktiles.tile_of(-179, 89) == (1, 1, 0, 0)
+    assert masktiles.tile_of(0.5, -0.5, SCALE, SIZE) == (11, 5, 4, 10)
+
+
+def test_tiles_of():
+    assert masktiles.tiles_of((0.5, -0.5, 0.7, -0.2), SCALE, SIZE) == \
+        [(11, 5)]
+    # a box across tile corners
+    assert masktiles.tiles_of((-5, -5, 5, 5), SCALE, SIZE) == \
+        [(10, 5), (11, 5)]
+    assert masktiles.tiles_of((-5, -20, 5, 5), SCALE, SIZE) == \
+        [(10, 5), (11, 5), (10, 6), (11, 6)]
+
+
+def test_tile_origin():
+    for tx, ty in [(0, 0), (11, 5), (22, 10)]:
+        west, north = masktiles.tile_origin(tx, ty, SCALE, SIZE)
+        assert masktiles.tile_of(west + .5, north - .5, SCALE, SIZE) == \
+            (tx, ty, 0, 0)
+
+
+def test_tile_size():
+    with pytest.raises(ValueError):
+        masktiles.TileCache('mask', tile_size=12)
+
+
+def random_mask(np, shape, seed=0):
+    return np.random.RandomState(seed).randint(0, 3, shape)
+
+
+def test_round_trip(tmpdir):
+    np = pytest.importorskip('numpy')
+    tiles = masktiles.TileCache('users/x/mask', str(tmpdir), SCALE, SIZE)
+    assert tiles.tile(11, 5) is None
+    assert tiles.value(0.5, -0.5) is None
+
+    array = random_mask(np, (SIZE, SIZE))
+    tiles.put(11, 5, array)
+    assert tiles.has(11, 5)
+    assert (tiles.tile(11, 5) == (array != 0)).all()
+
+    # every pixel, looked up by the coordinates of its center
+    west, north = masktiles.tile_origin(11, 5, SCALE, SIZE)
+    for row in range(SIZE):
+        for col in range(SIZE):
+            lon, lat = west + (col + .5) * SCALE, north - (row + .5) * SCALE
+            assert tiles.value(lon, lat) == bool(array[row, col])
+
+    # a new cache (a new run) reads the tile from disk
+    other = masktiles.TileCache('users/x/mask', str(tmpdir), SCALE, SIZE)
+    assert (other.tile(11, 5) == (array != 0)).all()
+
+
+def test_put_replaces_tile(tmpdir):
+    np = pytest.importorskip('numpy')
+    tiles = masktiles.TileCache('mask', str(tmpdir), SCALE, SIZE)
+    tiles.put(0, 0, np.ones((SIZE, SIZE)))
+    assert tiles.value(-179.5, 89.5)
+    tiles.put(0, 0, np.zeros((SIZE, SIZE)))
+    assert not tiles.value(-179.5, 89.5)
+    with pytest.raises(ValueError):
+        tiles.put(0, 0, np.zeros((SIZE, SIZE - 8)))
+
+
+def test_import_array(tmpdir):
+    np = pytest.importorskip('numpy')
+    tiles = masktiles.TileCache('mask', str(tmpdir), SCALE, SIZE)
+    west, north = masktiles.tile_origin(10, 5, SCALE, SIZE)
+    array = random_mask(np, (SIZE + 3, 2 * SIZE - 5))
+    assert tiles.import_array(array, west, north) == 4
+
+    for row in range(array.shape[0]):
+        for col in range(array.shape[1]):
+            lon, lat = west + (col + .5) * SCALE, north - (row + .5) * SCALE
+            assert tiles.value(lon, lat) == bool(array[row, col])
+    # beyond the array: outside the mask
+    assert not tiles.tile(11, 6)[3:, :].any()
+    assert not tiles.tile(11, 5)[:, SIZE - 5:].any()
+
+    with pytest.raises(ValueError):
+        tiles.import_array(array, west + .5, north)
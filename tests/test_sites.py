@@ -0,0 +1,105 @@
+# coding=utf-8
+
+import json
+import pytest
+from geepyGLAD import sites
+
+
+@pytest.fixture
+def describe(obj, monkeypatch):
+    monkeypatch.setattr(sites, 'describe',
+                        lambda geometry, maxError: obj(geometry.name))
+
+
+def test_site_cache_folder(server, obj, describe, tmpdir):
+    folder = str(tmpdir.join('sites'))
+    site = obj('site', {'bbox': 1})
+    sites.SiteCache(folder, version='v1').info(site)
+    # a new cache (a new run) reads the site from disk
+    assert sites.SiteCache(folder, version='v1').info(site) == {'bbox': 1}
+    assert server.requests == ['site']
+
+
+def test_site_cache_version(server, obj, describe, tmpdir):
+    folder = str(tmpdir.join('sites'))
+    site = obj('site', {'bbox': 1})
+    cache = sites.SiteCache(folder, version='v1')
+    cache.info(site)
+    # the other version shares the stored sites, but not this one
+    cache.versioned('v2').info(site)
+    assert server.requests == ['site', 'site']
+    cache.versioned('v2').info(site)
+    assert sites.SiteCache(folder, version='v2').info(site) == {'bbox': 1}
+    assert server.requests == ['site', 'site']
+
+
+def test_site_cache_max_age(server, obj, describe, monkeypatch):
+    site = obj('site', {'bbox': 1})
+    cache = sites.SiteCache(max_age=60)
+    now = [1000.]
+    monkeypatch.setattr(sites.time, 'time', lambda: now[0])
+    cache.info(site)
+    now[0] += 59
+    cache.info(site)
+    assert server.requests == ['site']
+    now[0] += 1
+    cache.info(site)
+    assert server.requests == ['site', 'site']
+
+
+def test_site_cache_old_entries(server, obj, describe, tmpdir):
+    folder = tmpdir.mkdir('sites')
+    site = obj('site', {'bbox': 1})
+    cache = sites.SiteCache(str(folder))
+    # written before the versions: the info without version
+    folder.join('{}.json'.format(cache._key(site))).write(
+        json.dumps({'bbox': 0}))
+    assert cache.info(site) == {'bbox': 1}
+    assert server.requests == ['site']
+
+
+def test_asset_version(monkeypatch):
+    monkeypatch.setattr(sites.ee.data, 'getAsset',
+                        lambda asset_id: {'updateTime': '2020-01-01T00:00'},
+                        raising=False)
+    assert sites.asset_version('users/x/sites') == '2020-01-01T00:00'
+
+    def missing(asset_id):
+        raise sites.ee.EEException('Asset not found.')
+    monkeypatch.setattr(sites.ee.data, 'getAsset', missing)
+    assert sites.asset_version('users/x/sites') is None
+
+
+def brute_force(items, bbox):
+    return sorted(value for box, value in items
+                  if sites.intersects(box, bbox))
+
+
+@pytest.mark.parametrize('count', [0, 1, 9, 10, 11, 250])
+def test_strtree_query(count):
+    import random
+    rand = random.Random(count)
+    items = []
+    for i in range(count):
+        x, y = rand.uniform(-80, 80), rand.uniform(-40, 40)
+        items.append(((x, y, x + rand.uniform(0, 5), y + rand.uniform(0, 5)),
+                      i))
+    tree = sites.STRtree(items, capacity=4)
+    queries = [(-180, -90, 180, 90), (0, 0, 0, 0), (200, 0, 210, 10)]
+    for _ in range(50):
+        x, y = rand.uniform(-90, 90), rand.uniform(-45, 45)
+        queries.append((x, y, x + rand.uniform(0, 20),
+                        y + rand.uniform(0, 20)))
+    for bbox in queries:
+        assert sorted(tree.query(bbox)) == brute_force(items, bbox)
+
+
+def test_bbox_of():
+    polygon = {'type': 'Polygon',
+               'coordinates': [[[0, 0], [2, -1], [3, 4], [0, 0]]]}
+    assert sites.bbox_of(polygon) == (0, -1, 3, 4)
+    assert sites.bbox_of({'type': 'Point', 'coordinates': [1, 2]}) == \
+        (1, 2, 1, 2)
+    # touching boxes intersect
+    assert sites.intersects((0, 0, 1, 1), (1, 1, 2, 2))
+    assert not sites.intersects((0, 0, 1, 1), (1.1, 0, 2, 1))
@@ -0,0 +1,87 @@
+# coding=utf-8
+
+import json
+import os
+import pytest
+from geepyGLAD import stream
+
+
+def feature(i):
+    return {'type': 'Feature',
+            'properties': {'id': i, 'name': 'á{}'.format(i)},
+            'geometry': {'type': 'Point', 'coordinates': [i, -i]}}
+
+
+FEATURES = [feature(i) for i in range(5)]
+
+
+def collection(features):
+    return json.dumps({'type': 'FeatureCollection',
+                       'columns': {'id': 'Integer'},
+                       'features': features})
+
+
+def test_writer_removes_partial_file(tmpdir):
+    path = str(tmpdir.join('alerts.geojson'))
+    with pytest.raises(RuntimeError):
+        with stream.FeatureWriter(path) as writer:
+            writer.write(FEATURES[0])
+            raise RuntimeError('download failed')
+    assert not os.path.exists(path)
+
+
+def test_writer(tmpdir):
+    path = str(tmpdir.join('alerts.geojson'))
+    with stream.FeatureWriter(path) as writer:
+        for feat in FEATURES:
+            writer.write(feat)
+    assert writer.count == len(FEATURES)
+    with open(path) as f:
+        assert json.load(f)['features'] == FEATURES
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_write_and_read(tmpdir, compression):
+    path = str(tmpdir.join('alerts.geojson{}'.format(
+        stream.extension(compression))))
+    with stream.FeatureWriter(path, compression) as writer:
+        for feat in FEATURES:
+            writer.write(feat)
+    assert stream.compression_of(path) == compression
+    assert list(stream.read(path)) == FEATURES
+
+
+def test_unknown_compression():
+    with pytest.raises(ValueError):
+        stream.extension('zip')
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 64, 100000])
+def test_parse_chunks(size):
+    text = collection(FEATURES)
+    chunks = [text[i:i + size] for i in range(0, len(text), size)]
+    assert list(stream.parse(chunks)) == FEATURES
+
+
+def test_parse_empty():
+    assert list(stream.parse([collection([])])) == []
+
+
+def test_decode_split_characters():
+    data = collection(FEATURES).encode('utf-8')
+    chunks = [data[i:i + 3] for i in range(0, len(data), 3)]
+    assert list(stream.parse(stream.decode(chunks))) == FEATURES
+
+
+def test_get_retries_error_status(fake_requests, no_sleep):
+    requests = fake_requests([503, 429, 200])
+    assert stream.get('url').status_code == 200
+    assert len(requests.responses) == 3
+    assert all(r.closed for r in requests.responses[:2])
+
+
+def test_get_does_not_retry_client_errors(fake_requests, no_sleep):
+    requests = fake_requests([400])
+    with pytest.raises(requests.HTTPError):
+        stream.get('url')
+    assert len(requests.responses) == 1